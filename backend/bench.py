@@ -0,0 +1,337 @@
+"""
+后端性能基准。结果以 JSON 输出，便于在 CI 中比较。
+
+    python bench.py startup --runs 5 --max-ms 1500
+    python bench.py api --stub-latency 0.05 --concurrency 1 8 32 --drafts 1000 10000 100000
+    python bench.py api --output new.json --baseline old.json --tolerance 0.2
+
+api 在进程内通过 ASGI 直接调用 main.app（不经过网络），LLM 使用本地桩实现，
+草稿存储使用临时 SQLite 数据库，不会影响 backend/drafts.db。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 在全新的解释器中计时，避免模块缓存影响结果
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def bench_startup(args):
+    """
+    测量 import main / import core 的耗时（每次都启动新进程）。
+    导入时不应创建 LLM 客户端或读取模板，因此不设置 GOOGLE_API_KEY 也必须能成功导入。
+    中位数超过 --max-ms 时以非零状态退出，可作为启动时间的回归保护。
+    """
+    env = {**os.environ, "GOOGLE_API_KEY": ""}
+    results = {}
+    failed = False
+    for module in args.modules:
+        samples = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+                cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            samples.append(float(output.strip().splitlines()[-1]) * 1000)
+        median = statistics.median(samples)
+        results[module] = {
+            "runs": args.runs,
+            "medianMs": round(median, 1),
+            "minMs": round(min(samples), 1),
+            "maxMs": round(max(samples), 1),
+        }
+        if args.max_ms and median > args.max_ms:
+            results[module]["regression"] = True
+            failed = True
+    print(json.dumps({"benchmark": "startup", "results": results}, indent=2))
+    return 1 if failed else 0
+
+
+# 五种模板的示例请求；{i} 替换为请求序号，使每个请求都不相同（避免命中缓存或被合并）
+TEMPLATE_PAYLOADS = {
+    "course_registration": {
+        "startDate": "2025-03-01", "endDate": "2025-03-15", "targetAudience": "All students",
+        "additionalNote": "Bitte Matrikelnummer angeben ({i})",
+    },
+    "course_registration:template": {
+        "templateType": "course_registration",
+        "startDate": "2025-03-01", "endDate": "2025-03-15", "targetAudience": "B.Sc. / M.Sc. IN", "name": "Team {i}",
+    },
+    "event_notice": {
+        "courseName": "Career Day {i}", "additionalNote": "Meet companies from Munich",
+        "eventTime": "2025-05-20 10:00", "location": "MI HS1", "targetAudience": "All students",
+    },
+    "schedule_request": {
+        "courseName": "Analysis {i}", "courseCode": "MA1001", "semester": "SS 2025",
+        "timeOptions": "Mon 10-12, Tue 14-16", "replyDeadline": "2025-02-01",
+    },
+    "schedule_announcement": {
+        "courseName": "Linear Algebra {i}", "courseCode": "MA1101", "instructorName": "Prof. Müller",
+        "courseStartDate": "2025-04-22", "weeklyTime": "Thu 8-10", "weeklyLocation": "MW 0001",
+    },
+    "schedule_change": {
+        "courseName": "Numerics {i}", "reason": "Krankheit", "oldTime": "Mon 10-12",
+        "newTime": "Wed 10-12", "oldLocation": "MI HS2",
+    },
+}
+
+
+# 种子草稿正文的词表，以及 drafts:search 场景随机使用的搜索词
+SEED_WORDS = (
+    "Prüfung Vorlesung Raum Termin Anmeldung Semester Frist Bibliothek Mensa Feiertag Kurs "
+    "Seminar Übung Klausur Ergebnis Sprechstunde Änderung Veranstaltung Hörsaal Woche "
+    "lecture exam room deadline registration course schedule change library holiday"
+).split()
+SEARCH_TERMS = ["Draft 42", "studierende", "klausur", "prüfung hörsaal", "Draft 9", "registration deadline"]
+
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数（sorted_values 已排序）"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def run_load(client, make_request, total, concurrency):
+    """
+    以 concurrency 个并发 worker 发出 total 个请求。
+    make_request(i) 返回 (method, url, kwargs)；返回吞吐量和延迟分位数。
+    """
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            method, url, kwargs = make_request(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput": round(total / elapsed, 1),
+        "p50Ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95Ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99Ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def generation_scenarios():
+    """生成类接口：五种模板、自由提示和二次编辑，全部带 bypassCache 以测量实际生成路径"""
+    scenarios = {}
+    for name, payload in TEMPLATE_PAYLOADS.items():
+        body = {"templateType": name, **payload, "bypassCache": True}
+
+        def make(i, body=body):
+            data = {k: v.format(i=i) if isinstance(v, str) else v for k, v in body.items()}
+            return "POST", "/api/generate", {"json": data}
+        scenarios["generate:" + name] = make
+    scenarios["free_prompt"] = lambda i: ("POST", "/api/free_prompt", {
+        "json": {"prompt": f"Bibliothek am Freitag geschlossen ({i})", "tone": "friendly"}})
+    scenarios["gemini_edit"] = lambda i: ("POST", "/api/gemini_edit", {
+        "json": {"content": f"Liebe Studierende,<br>Entwurf {i}", "instruction": "Bitte kürzer"}})
+    return scenarios
+
+
+def seed_drafts(main_module, count, workdir):
+    """
+    用 count 条草稿初始化一个新的临时草稿库，返回全部草稿 id。
+    通过 migrate_from_json 在单个事务中导入，比逐条创建快得多。
+    """
+    source = os.path.join(workdir, f"seed-{count}.json")
+    now = time.time()
+    drafts = [
+        {
+            "id": f"bench-{count}-{n}",
+            "type": random.choice(list(TEMPLATE_PAYLOADS)).split(":")[0],
+            "title": f"Draft {n}",
+            "content": "Liebe Studierende,<br>" + " ".join(random.choices(SEED_WORDS, k=120)),
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now - n)),
+        }
+        for n in range(count)
+    ]
+    with open(source, "w", encoding="utf-8") as f:
+        json.dump(drafts, f, ensure_ascii=False)
+    store = main_module.open_draft_store("sqlite", os.path.join(workdir, f"drafts-{count}.db"))
+    store.migrate_from_json(source)
+    os.remove(source)
+    main_module._draft_store = store
+    return [draft["id"] for draft in drafts]
+
+
+def draft_scenarios(ids, created):
+    """草稿 CRUD：列表（分页/字段投影/类型筛选）、按 id 读取、创建、更新、删除"""
+    return {
+        "drafts:list": lambda i: ("GET", "/api/drafts", {"params": {"limit": 50}}),
+        "drafts:list_fields": lambda i: ("GET", "/api/drafts", {
+            "params": {"limit": 50, "fields": "title,type,createdAt"}}),
+        "drafts:list_type": lambda i: ("GET", "/api/drafts", {
+            "params": {"limit": 50, "type": "schedule_change"}}),
+        "drafts:get": lambda i: ("GET", f"/api/drafts/{random.choice(ids)}", {}),
+        "drafts:search": lambda i: ("GET", "/api/drafts/search", {
+            "params": {"q": random.choice(SEARCH_TERMS), "limit": 20}}),
+        "drafts:create": lambda i: ("POST", "/api/drafts", {"json": {
+            "type": "free_prompt", "title": f"Bench {i}", "content": "Benchmark draft " * 50}}),
+        "drafts:update": lambda i: ("PUT", f"/api/drafts/{created[i % len(created)]}", {
+            "json": {"title": f"Updated {i}"}}),
+        "drafts:delete": lambda i: ("DELETE", f"/api/drafts/{created[i % len(created)]}", {}),
+    }
+
+
+def compare_baseline(results, baseline_path, tolerance):
+    """与基线结果比较 p95，超过 (1 + tolerance) 倍的场景标记为 regression"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {
+            (r["scenario"], r.get("drafts"), r["concurrency"]): r
+            for r in json.load(f)["results"]
+        }
+    failed = False
+    for result in results:
+        previous = baseline.get((result["scenario"], result.get("drafts"), result["concurrency"]))
+        if previous and result["p95Ms"] > previous["p95Ms"] * (1 + tolerance):
+            result["regression"] = {"baselineP95Ms": previous["p95Ms"]}
+            failed = True
+    return failed
+
+
+async def _bench_api(args, workdir):
+    import httpx
+    import core
+    import main as main_module
+    from llm_providers import StubProvider
+
+    core.set_provider(StubProvider(latency=args.stub_latency, output_chars=args.stub_output_chars))
+    core.templates.reload()
+    selected = set(args.scenarios or [])
+
+    def wanted(name):
+        return not selected or name in selected or name.split(":")[0] in selected
+
+    results = []
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def run(name, make_request, total, drafts=None):
+            for concurrency in args.concurrency:
+                result = await run_load(client, make_request, total, concurrency)
+                result = {"scenario": name, **({"drafts": drafts} if drafts is not None else {}), **result}
+                results.append(result)
+                print(f"{name:<36} drafts={drafts or '-':<7} c={concurrency:<4} "
+                      f"{result['throughput']:>8} req/s  p95={result['p95Ms']} ms", file=sys.stderr)
+
+        seed_drafts(main_module, 0, workdir)
+        for name, make_request in generation_scenarios().items():
+            if wanted(name):
+                await run(name, make_request, args.requests)
+
+        for count in args.drafts:
+            if not any(wanted(name) for name in draft_scenarios([], [])):
+                break
+            ids = seed_drafts(main_module, count, workdir)
+            created = []
+            scenarios = draft_scenarios(ids, created)
+            for name in ("drafts:list", "drafts:list_fields", "drafts:list_type", "drafts:get",
+                         "drafts:search", "drafts:create"):
+                if wanted(name):
+                    await run(name, scenarios[name], args.requests, count)
+            # 更新和删除作用于基准中新建的草稿，保持种子数据不变
+            created.extend(
+                draft["id"] for draft in main_module._draft_store.query_drafts(
+                    limit=args.requests, fields=["id"])[0]
+            )
+            for name in ("drafts:update", "drafts:delete"):
+                if wanted(name) and created:
+                    await run(name, scenarios[name], min(args.requests, len(created)), count)
+    return results
+
+
+def bench_api(args):
+    """
+    对 main.py 的各个接口做负载测试（LLM 为可配置延迟的本地桩），
+    输出各场景在不同并发度下的吞吐量和 p50/p95/p99 延迟。
+    指定 --baseline 时与之前的结果比较，p95 回退超过 --tolerance 时以非零状态退出。
+    """
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["RESPONSE_CACHE_DB"] = ""
+    # 压测的是本服务自身的开销，不受上游配额的准入控制限制
+    os.environ["LLM_RPM"] = "0"
+    os.environ["LLM_TPM"] = "0"
+    sys.path.insert(0, BASE_DIR)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DRAFTS_DB"] = os.path.join(workdir, "drafts.db")
+        results = asyncio.run(_bench_api(args, workdir))
+
+    failed = compare_baseline(results, args.baseline, args.tolerance) if args.baseline else False
+    report = {
+        "benchmark": "api",
+        "config": {
+            "stubLatency": args.stub_latency,
+            "stubOutputChars": args.stub_output_chars,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "drafts": args.drafts,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TUM Assistants 后端性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    startup = subparsers.add_parser("startup", help="模块导入（worker 启动）耗时")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--modules", nargs="+", default=["core", "main"])
+    startup.add_argument("--max-ms", type=float, default=None,
+                         help="中位数超过该值（毫秒）时返回非零状态")
+    startup.set_defaults(func=bench_startup)
+
+    api = subparsers.add_parser("api", help="接口吞吐量和延迟（本地桩 LLM）")
+    api.add_argument("--stub-latency", type=float, default=0.05, help="桩 LLM 每次调用的延迟（秒）")
+    api.add_argument("--stub-output-chars", type=int, default=1500)
+    api.add_argument("--requests", type=int, default=200, help="每个场景、每个并发度的请求数")
+    api.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    api.add_argument("--drafts", type=int, nargs="+", default=[1000, 10000, 100000],
+                     help="草稿 CRUD 场景的草稿库规模")
+    api.add_argument("--scenarios", nargs="+", default=None,
+                     help="只运行指定场景，例如 generate drafts:get free_prompt")
+    api.add_argument("--output", default=None, help="结果写入文件（默认输出到 stdout）")
+    api.add_argument("--baseline", default=None, help="用于比较的历史结果文件")
+    api.add_argument("--tolerance", type=float, default=0.2, help="允许的 p95 回退比例")
+    api.set_defaults(func=bench_api)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
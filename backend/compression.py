@@ -0,0 +1,102 @@
+"""
+响应压缩中间件（ASGI）：较大的 JSON / HTML / 文本响应按客户端支持的编码压缩。
+安装了 brotli 包时优先使用 br，否则使用 gzip；brotli 是可选依赖，未安装时不影响启动。
+"""
+import re
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "application/javascript", "text/css")
+# 压缩后的强 ETag 带有编码后缀，例如 "5" -> "5-gzip"
+ENCODED_ETAG = re.compile(r'-(?:gzip|br)"$')
+
+
+def base_etag(tag):
+    """去掉压缩时附加的编码后缀，得到原始 ETag"""
+    return ENCODED_ETAG.sub('"', tag.strip())
+
+
+def choose_encoding(accept_encoding):
+    """按 Accept-Encoding 选择压缩编码（br 优先），都不支持时返回 None"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    只压缩一次性发送的响应体：流式响应（SSE、NDJSON）原样透传，
+    否则压缩器会缓冲数据，事件不能及时推送到客户端。
+    同一资源的不同编码不能共用一个强 ETag，压缩后的响应在 ETag 后附加编码后缀，
+    比较 If-None-Match / If-Match 时用 base_etag 去掉后缀。
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        streaming = False
+
+        async def send_compressed(message):
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # 流式响应：之后的块直接发送
+                streaming = True
+                await send(start)
+                await send(message)
+                return
+            content_type = headers.get("content-type", "")
+            if content_type.startswith(COMPRESSIBLE_TYPES) and "content-encoding" not in headers:
+                headers.add_vary_header("Accept-Encoding")
+                if encoding and len(body) >= self.minimum_size:
+                    body = self.compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    etag = headers.get("etag")
+                    if etag and etag.endswith('"') and not etag.startswith("W/"):
+                        headers["ETag"] = etag[:-1] + f'-{encoding}"'
+                    message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
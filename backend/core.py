@@ -1,351 +1,1464 @@
 import os
+import re
 import json
-from google import genai
+import math
+import time
+import heapq
+import contextvars
+import datetime
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from llm_providers import create_provider
+import metrics
+from sqlite_db import SQLiteDatabase
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
-# 配置 Gemini API
-# 确保您的 .env 文件中有 GOOGLE_API_KEY
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("请在 .env 文件中设置 GOOGLE_API_KEY")
+# 导入本模块时不做任何初始化：LLM 客户端、模板和缓存数据库都在首次使用时
+# （或由 main.py 的 lifespan 在启动时）创建，测试和多进程部署不必为此付出启动开销。
 
-# 创建客户端实例
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# LLM 后端：LLM_PROVIDER=gemini（默认，需要 GOOGLE_API_KEY）或 stub（本地桩，用于压测和离线开发）
+_provider = None
 
-def read_note():
-    """读取笔记文件内容"""
-    try:
-        with open('./data/All/note.txt', 'r', encoding='utf-8') as file:
-            content = file.read().strip()
-            return content if content else None
-    except Exception as e:
-        print(f"读取笔记文件时发生错误：{str(e)}")
-        return None
+def get_provider():
+    """返回 LLM 后端实例，首次调用时创建"""
+    global _provider
+    if _provider is None:
+        _provider = create_provider()
+    return _provider
+
+def set_provider(provider):
+    """替换 LLM 后端（用于测试或压测）"""
+    global _provider
+    _provider = provider
+
+# 路径均相对于本文件所在目录，不依赖进程的工作目录
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+# 默认使用的模型
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# 同时进行的 Gemini 调用上限，可通过 .env 中的 GEMINI_CONCURRENCY 配置
+GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', '8'))
+_generation_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+# 单次调用的超时时间（秒）、可重试错误的最大重试次数和退避参数
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '8'))
 
-def process_course_registration(time_start=None, time_end=None, target_group=None, name=None):
+class LLMError(Exception):
     """
-    读取课程注册信息并生成通知
+    Gemini 调用失败。code 为错误类型，status 为对应的 HTTP 状态码：
+    timeout(504) / rate_limited(429) / upstream_error(502) / bad_request(400) / circuit_open(503)
     """
-    # 读取文件内容
-    file_path = './data/Student/course_registration.txt'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取文件时发生错误：{str(e)}")
-        return None
 
-    # 读取笔记内容
-    note_content = read_note()
-
-    # 替换变量（如果提供）
-    if time_start:
-        template = template.replace("{time_start}", time_start)
-    if time_end:
-        template = template.replace("{time_end}", time_end)
-    if target_group:
-        template = template.replace("{target_group}", target_group)
-    if name:
-        template = template.replace("{name}", name)
-    if note_content:
-        template = template.replace("{note}", note_content)
-
-    # 构造提示
-    prompt = f"""
-    请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
-    如果note_content内容为空，则**Hinweis:**和**Note:**应该不显示。
-    否则请将note_content内容添加在**Hinweis:**或者**Note:**后。
-    无论note_content是什么语言，你都应该转化成信件相应的德语和英语，并使用相应的信件语言。
-    保持所有格式标记（如 **、换行等）不变。
-    如果模板中有未替换的变量（如 {{time_start}}），请保持原样。
-    如果模板中{{time_start}}或者{{time_end}}未被添加，请添加为今天的日期。如果用户写入until + 日期，或者 bis + 日期，或者日期写成其他格式，你也应该识别出来。
-    如果模板中{{target_group}}未被添加，请添加为所有人。
-    如果模板中{{name}}未被添加，请添加为Student Service Center。
-    确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM应为德语或英语月份（在德语版本为德语，在英语版本为英语），而不是数字。
-    请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+    STATUS = {
+        "timeout": 504,
+        "rate_limited": 429,
+        "upstream_error": 502,
+        "bad_request": 400,
+        "circuit_open": 503,
+    }
+
+    def __init__(self, code, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status = self.STATUS.get(code, 502)
+
+    def to_dict(self):
+        error = {"code": self.code, "message": self.message, "retryable": self.retryable}
+        if self.retry_after is not None:
+            error["retryAfter"] = self.retry_after
+        return error
+
+def classify_llm_error(error):
+    """把底层异常转换为 LLMError，并判断是否值得重试"""
+    if isinstance(error, LLMError):
+        return error
+    if isinstance(error, asyncio.TimeoutError):
+        return LLMError("timeout", f"Gemini 调用超过 {LLM_TIMEOUT:g} 秒未返回", retryable=True)
+    # 只在出错时才导入，避免 import core 时加载整个 SDK
+    import httpx
+    from google.genai import errors as genai_errors
+    if isinstance(error, genai_errors.APIError):
+        if error.code == 429:
+            return LLMError("rate_limited", str(error), retryable=True)
+        if error.code and error.code >= 500:
+            return LLMError("upstream_error", str(error), retryable=True)
+        return LLMError("bad_request", str(error))
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return LLMError("upstream_error", str(error) or type(error).__name__, retryable=True)
+    return LLMError("upstream_error", str(error) or type(error).__name__)
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后熔断 reset_timeout 秒，期间所有调用直接失败；
+    到期后放行一个试探请求，成功则恢复，失败则重新熔断。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        remaining = self.reset_timeout - (now - self.opened_at)
+        # 试探请求被取消等情况下，超过 reset_timeout 后允许新的试探
+        trial_running = self.trial_started is not None and now - self.trial_started < self.reset_timeout
+        if remaining > 0 or trial_running:
+            raise LLMError(
+                "circuit_open", "Gemini 服务暂时不可用，请稍后重试",
+                retryable=True, retry_after=max(1, round(remaining))
+            )
+        self.trial_started = now
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_started = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def status(self):
+        return {"state": self.state, "consecutiveFailures": self.failures}
+
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30')),
+)
+
+# 当前请求调用 LLM 时的优先级：interactive（交互式编辑）/ normal / batch（批量生成和后台任务）
+# 由 main.py 的接口在调用生成函数之前设置，生成过程中创建的任务会继承
+llm_priority = contextvars.ContextVar('llm_priority', default="normal")
 
+# 估算 token 数时每个 token 对应的字符数，以及预估的输出 token 数（调用完成后按实际用量修正）
+CHARS_PER_TOKEN = 4
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv('LLM_EXPECTED_OUTPUT_TOKENS', '800'))
 
-    模板内容：
-    {template}
+def estimate_tokens(prompt, context=None):
+    """一次调用预计消耗的 token 数（输入按字符数估算，加上预估的输出）"""
+    return (len(context or "") + len(prompt)) // CHARS_PER_TOKEN + LLM_EXPECTED_OUTPUT_TOKENS
+
+class AdmissionController:
     """
-    
-    print("\n正在生成通知...")
-    try:
-        # 生成内容
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
+    上游配额的准入控制：每分钟请求数（rpm）和每分钟 token 数（tpm）两个令牌桶，为 0 时不限制。
+    令牌不足时按优先级排队（interactive > normal > batch，同一优先级先到先得），
+    预计等待超过该优先级的 max_wait 秒或队列已满时直接拒绝（LLMError rate_limited，带 retry_after）。
+    priority_rpm 可以再为某个优先级单独限制每分钟请求数（例如批量生成），同样随 429 升降。
+    上游返回 429 时速率减半（乘性减，冷却期内只减一次），之后每次成功调用恢复 recovery（加性增）。
+    """
+
+    PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+    PRIORITY_NAMES = {rank: name for name, rank in PRIORITIES.items()}
+
+    def __init__(self, rpm, tpm, max_wait=None, max_queue=200, min_factor=0.1, recovery=0.02, cooldown=5.0,
+                 priority_rpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.priority_rpm = {name: limit for name, limit in (priority_rpm or {}).items() if limit}
+        self.priority_requests = {name: float(limit) for name, limit in self.priority_rpm.items()}
+        self.max_wait = max_wait or {"interactive": 10.0, "normal": 10.0, "batch": 300.0}
+        self.max_queue = max_queue
+        self.min_factor = min_factor
+        self.recovery = recovery
+        self.cooldown = cooldown
+        self.factor = 1.0
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.decreased_at = None
+        self._waiting = []  # 堆：(优先级, 序号, token 数, future)
+        self._seq = 0
+        self._timer = None
+        self.admitted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm * self.factor, self.requests + elapsed * self.rpm * self.factor / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm * self.factor, self.tokens + elapsed * self.tpm * self.factor / 60)
+        for name, limit in self.priority_rpm.items():
+            self.priority_requests[name] = min(
+                limit * self.factor, self.priority_requests[name] + elapsed * limit * self.factor / 60
+            )
+
+    def _wait_time(self, requests, tokens, priority=None, priority_requests=1):
+        """
+        两个桶都攒够 requests 个请求和 tokens 个 token，
+        且该优先级自己的桶（如果有）攒够 priority_requests 个请求还需要的秒数
+        """
+        wait = 0.0
+        limit = self.priority_rpm.get(priority)
+        if limit:
+            needed = min(priority_requests, limit * self.factor) - self.priority_requests[priority]
+            wait = max(wait, needed * 60 / (limit * self.factor))
+        # 单次需求超过桶容量时，桶满即可放行（之后欠账）
+        if self.rpm:
+            needed = min(requests, self.rpm * self.factor) - self.requests
+            wait = max(wait, needed * 60 / (self.rpm * self.factor))
+        if self.tpm:
+            needed = min(tokens, self.tpm * self.factor) - self.tokens
+            wait = max(wait, needed * 60 / (self.tpm * self.factor))
+        return wait
+
+    def _take(self, tokens, priority=None):
+        self.requests -= 1
+        self.tokens -= tokens
+        if priority in self.priority_requests:
+            self.priority_requests[priority] -= 1
+        self.admitted += 1
+
+    def _reject(self, priority, wait):
+        self.rejected += 1
+        metrics.LLM_ADMISSIONS.inc(priority=priority, result="rejected")
+        return LLMError(
+            "rate_limited", "Gemini 请求过多，请稍后重试",
+            retryable=True, retry_after=max(1, math.ceil(wait))
         )
-        
-        generated_content = response.text
-        
-        # 确保内容保持格式
-        generated_content = generated_content.replace('\n', '<br>')
-        
-        # 清空note.txt文件
-        with open('data/All/note.txt', 'w', encoding='utf-8') as f:
-            f.write('')
-            
-        return generated_content
-
-    except Exception as e:
-        print(f"\n发生错误：{str(e)}")
-        return None
 
-def process_event_notice(event_name=None, event_intro=None, event_time=None, event_location=None, target_group=None, registration=None, language=None, name=None):
+    def _dispatch(self):
+        """按优先级放行排在最前面的等待者，令牌不足时定时到攒够为止再试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiting:
+            rank, _, tokens, future = self._waiting[0]
+            if future.done():
+                heapq.heappop(self._waiting)
+                continue
+            priority = self.PRIORITY_NAMES[rank]
+            wait = self._wait_time(1, tokens, priority)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiting)
+            self._take(tokens, priority)
+            future.set_result(None)
+
+    async def acquire(self, tokens, priority=None):
+        """等待放行一次预计消耗 tokens 个 token 的调用，优先级默认取 llm_priority"""
+        priority = priority or llm_priority.get()
+        rank = self.PRIORITIES.get(priority, self.PRIORITIES["normal"])
+        priority = self.PRIORITY_NAMES[rank]
+        self._refill()
+        if not self._waiting and self._wait_time(1, tokens, priority) <= 0:
+            self._take(tokens, priority)
+            metrics.LLM_ADMISSIONS.inc(priority=priority, result="admitted")
+            return
+
+        # 预计等待：排在前面（优先级不低于本请求）的调用加上本次调用所需的令牌
+        ahead = [entry for entry in self._waiting if entry[0] <= rank and not entry[3].done()]
+        same = sum(1 for entry in ahead if entry[0] == rank) + 1
+        wait = self._wait_time(len(ahead) + 1, sum(entry[2] for entry in ahead) + tokens, priority, same)
+        max_wait = self.max_wait.get(priority, self.max_wait["normal"])
+        if len(self._waiting) >= self.max_queue or wait > max_wait:
+            raise self._reject(priority, wait)
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiting, (rank, self._seq, tokens, future))
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject(priority, self._wait_time(len(ahead) + 1, tokens, priority, same)) from None
+        finally:
+            if not future.done() or future.cancelled():
+                # 放弃等待后让后面的等待者有机会放行
+                self._dispatch()
+        metrics.LLM_ADMISSIONS.inc(priority=priority, result="queued")
+        metrics.LLM_ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started, priority=priority)
+
+    def charge(self, tokens):
+        """不经排队直接记账（重试同样消耗上游配额，不足时形成欠账，推迟后续放行）"""
+        self._refill()
+        self._take(tokens)
+
+    def settle(self, estimated, actual):
+        """调用完成后按实际 token 用量修正预估值"""
+        if actual:
+            self.tokens -= actual - estimated
+
+    def record_rate_limited(self):
+        self.rate_limited += 1
+        now = time.monotonic()
+        if self.decreased_at is not None and now - self.decreased_at < self.cooldown:
+            return
+        self.decreased_at = now
+        self._refill()
+        self.factor = max(self.min_factor, self.factor / 2)
+        # 停止突发：已积攒的请求令牌作废
+        self.requests = min(self.requests, 0.0)
+        self.tokens = min(self.tokens, self.tpm * self.factor)
+        print(f"Gemini 返回 429，准入速率降至 {self.factor:.0%}")
+
+    def record_success(self):
+        if self.factor < 1.0:
+            self._refill()
+            self.factor = min(1.0, self.factor + self.recovery)
+
+    def status(self):
+        queued = {}
+        for rank, _, _, future in self._waiting:
+            if not future.done():
+                name = self.PRIORITY_NAMES[rank]
+                queued[name] = queued.get(name, 0) + 1
+        self._refill()
+        return {
+            "rateFactor": round(self.factor, 3),
+            "requestsPerMinute": round(self.rpm * self.factor, 1) if self.rpm else None,
+            "tokensPerMinute": round(self.tpm * self.factor) if self.tpm else None,
+            "availableRequests": round(self.requests, 1) if self.rpm else None,
+            "availableTokens": round(self.tokens) if self.tpm else None,
+            "priorityRequestsPerMinute": {
+                name: round(limit * self.factor, 1) for name, limit in self.priority_rpm.items()
+            },
+            "queued": queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "rateLimited": self.rate_limited,
+        }
+
+# 同一个 API key 由几个 worker 进程共用（main.py --workers 启动时设置），配额按进程平分，
+# 各进程的令牌桶互不通信，合计仍不超过 LLM_RPM / LLM_TPM；多台机器部署时按总进程数设置
+APP_WORKERS = max(1, int(os.getenv('APP_WORKERS', '1')))
+
+# 配额默认值对应 Gemini 付费第一档的一部分，按实际配额在 .env 中调整
+admission_controller = AdmissionController(
+    rpm=float(os.getenv('LLM_RPM', '300')) / APP_WORKERS,
+    tpm=float(os.getenv('LLM_TPM', '1000000')) / APP_WORKERS,
+    max_wait={
+        "interactive": float(os.getenv('LLM_ADMISSION_WAIT', '10')),
+        "normal": float(os.getenv('LLM_ADMISSION_WAIT', '10')),
+        "batch": float(os.getenv('LLM_ADMISSION_BATCH_WAIT', '300')),
+    },
+    max_queue=int(os.getenv('LLM_ADMISSION_QUEUE', '200')),
+    # 批量生成和后台任务每分钟最多发起的 LLM 调用数，不占满交互式请求的配额
+    priority_rpm={"batch": float(os.getenv('BATCH_RATE_PER_MINUTE', '60')) / APP_WORKERS},
+)
+
+def backoff_delay(attempt):
+    """指数退避加全抖动：在 [0, min(上限, base * 2^attempt)] 内随机取值"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+async def invoke_llm(make_call, timeout=None, retries=None, breaker=None, admission=None, tokens=0):
     """
-    读取campus活动信息并生成通知
+    统一的 LLM 调用封装：每次调用有超时限制，可重试的错误按指数退避重试，
+    并经过熔断器；最终失败时抛出 LLMError。
+    make_call 为无参函数，每次调用返回一个新的协程（便于重试，也便于用假客户端测试）。
+    首次调用的准入由调用方在占用并发名额之前完成；这里把上游的 429 和成功反馈给准入控制，
+    重试按 tokens 计入配额。
     """
-    # 读取文件内容
-    file_path = './data/Student/event_notice.txt'
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    breaker = breaker or circuit_breaker
+    admission = admission or admission_controller
+    attempt = 0
+    while True:
+        breaker.before_call()
+        if attempt:
+            admission.charge(tokens)
+        try:
+            result = await asyncio.wait_for(make_call(), timeout)
+        except Exception as e:
+            error = classify_llm_error(e)
+            if error.code == "bad_request":
+                # 请求本身有问题，说明上游可用，不计入熔断
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if error.code == "rate_limited":
+                admission.record_rate_limited()
+            if not error.retryable or error.code == "circuit_open" or attempt >= retries:
+                raise error from e
+            delay = backoff_delay(attempt)
+            attempt += 1
+            print(f"Gemini 调用失败（{error.code}），{delay:.2f} 秒后第 {attempt} 次重试")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        admission.record_success()
+        return result
+
+class SingleFlight:
+    """
+    合并相同的进行中请求：同一个键同时只发起一次上游调用，
+    其余调用方等待并共享结果（包括异常）。
+    所有等待方都取消时才取消上游调用，单个客户端断开不会影响其他人。
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> [task, 等待方数量]
+        self.calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update((part or "").encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def do(self, key, make_call):
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(make_call())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+            metrics.COALESCED_REQUESTS.inc()
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        except asyncio.CancelledError:
+            if not call[0].done() and call[1] == 1:
+                call[0].cancel()
+            raise
+        finally:
+            call[1] -= 1
+
+    def stats(self):
+        total = self.calls + self.coalesced
+        return {
+            "inFlight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalescedRate": self.coalesced / total if total else 0.0,
+        }
+
+single_flight = SingleFlight()
+
+@contextmanager
+def llm_call_timer(provider, mode):
+    """记录一次 LLM 调用的耗时和结果（ok 或 LLMError 的 code）"""
+    started = time.perf_counter()
+    outcome = "ok"
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取文件时发生错误：{str(e)}")
+        yield
+    except LLMError as e:
+        outcome = e.code
+        metrics.LLM_ERRORS.inc(provider=provider.name, code=e.code)
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        metrics.LLM_CALL_SECONDS.observe(
+            time.perf_counter() - started, provider=provider.name, mode=mode, outcome=outcome)
+
+# 按模板类型累计的 token 用量：template_type -> {calls, inputTokens, cachedTokens, outputTokens}
+token_usage = {}
+
+def record_token_usage(provider, template_type, response):
+    """记录一次调用的 token 用量（指标和 /api/llm/status 中的汇总）"""
+    template_type = template_type or "other"
+    usage = token_usage.setdefault(
+        template_type, {"calls": 0, "inputTokens": 0, "cachedTokens": 0, "outputTokens": 0}
+    )
+    usage["calls"] += 1
+    for kind, field in (("input", "inputTokens"), ("cached", "cachedTokens"), ("output", "outputTokens")):
+        tokens = getattr(response, kind + "_tokens") or 0
+        usage[field] += tokens
+        if tokens:
+            metrics.LLM_TOKENS.inc(tokens, provider=provider.name, template_type=template_type, kind=kind)
+
+def token_usage_stats():
+    """各模板类型的平均 token 数，以及输入中命中上下文缓存的比例"""
+    stats = {}
+    for template_type, usage in token_usage.items():
+        calls = usage["calls"] or 1
+        stats[template_type] = {
+            **usage,
+            "avgInputTokens": round(usage["inputTokens"] / calls, 1),
+            "avgUncachedInputTokens": round((usage["inputTokens"] - usage["cachedTokens"]) / calls, 1),
+            "cachedRatio": usage["cachedTokens"] / usage["inputTokens"] if usage["inputTokens"] else 0.0,
+        }
+    return stats
+
+async def generate_text(prompt, model=GEMINI_MODEL, context=None, template_type=None):
+    """
+    异步调用 LLM 后端生成文本。
+    后端均为异步实现，不会阻塞事件循环；并发数受 GEMINI_CONCURRENCY 限制。
+    context 为可缓存的静态前缀（指令和模板），prompt 只包含本次请求变化的部分。
+    提示词、上下文和模型都相同的并发调用会被合并为一次上游请求。
+    合并只在同一优先级内进行：共享的调用按发起者的优先级排队，
+    否则交互式请求可能跟在批量请求后面等待准入。
+    调用前先经过准入控制（按 llm_priority 排队，超出配额时抛出 rate_limited），
+    超时、重试和熔断由 invoke_llm 处理，失败时抛出 LLMError。
+    """
+    async def call():
+        provider = get_provider()
+        tokens = estimate_tokens(prompt, context)
+        await admission_controller.acquire(tokens)
+        async with _generation_semaphore:
+            with llm_call_timer(provider, "generate"):
+                response = await invoke_llm(lambda: provider.generate(prompt, model, context), tokens=tokens)
+        admission_controller.settle(tokens, (response.input_tokens or 0) + (response.output_tokens or 0))
+        record_token_usage(provider, template_type, response)
+        return response.text
+
+    key = SingleFlight.make_key(llm_priority.get(), model, context, prompt.strip())
+    return await single_flight.do(key, call)
+
+async def generate_text_stream(prompt, model=GEMINI_MODEL, context=None):
+    """
+    异步流式调用 LLM 后端，逐块产出生成的文本。
+    收到第一块之前的失败按 invoke_llm 的规则重试；已经开始输出后不再重试，
+    每块之间的等待同样受 LLM_TIMEOUT 限制。准入控制与 generate_text 相同。
+    """
+    provider = get_provider()
+    tokens = estimate_tokens(prompt, context)
+    await admission_controller.acquire(tokens)
+
+    async def open_stream():
+        stream = provider.generate_stream(prompt, model, context)
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+
+    async with _generation_semaphore:
+        with llm_call_timer(provider, "stream"):
+            stream, chunk = await invoke_llm(open_stream, tokens=tokens)
+            while chunk is not None:
+                yield chunk
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), LLM_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    circuit_breaker.record_failure()
+                    raise classify_llm_error(e) from e
+
+# 模板中的占位符，例如 {course_name}
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+# 双语模板中英文部分的起始标记
+ENGLISH_MARKER = "[English]"
+
+class CompiledTemplate:
+    """
+    预先切分好的模板：字面量片段与占位符交替排列。
+    渲染时一次拼接完成，不再对整段模板反复调用 str.replace。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        # (是否为占位符, 字面量或占位符名, 所在语言)；[English] 标记之前为德语部分
+        self.segments = []
+        language = "de"
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            if match.start() > position:
+                literal = text[position:match.start()]
+                self.segments.append((False, literal, language))
+                if ENGLISH_MARKER in literal:
+                    language = "en"
+            self.segments.append((True, match.group(1), language))
+            position = match.end()
+        if position < len(text):
+            self.segments.append((False, text[position:], language))
+        self.placeholders = list(dict.fromkeys(name for is_field, name, _ in self.segments if is_field))
+
+    def render(self, values, defaults=None):
+        """
+        用 values 填充占位符，空值时使用 defaults 中的默认值。
+        值可以是字符串，也可以是 {"de": ..., "en": ...}，按占位符所在语言取值。
+        两者都没有的占位符原样保留（交给 Gemini 处理），
+        返回 (渲染结果, 未填写的占位符列表)。
+        """
+        defaults = defaults or {}
+        parts = []
+        missing = []
+        for is_field, value, language in self.segments:
+            if not is_field:
+                parts.append(value)
+                continue
+            filled = values.get(value) or defaults.get(value)
+            if isinstance(filled, dict):
+                filled = filled.get(language)
+            if filled:
+                parts.append(filled)
+            else:
+                parts.append("{" + value + "}")
+                if value not in missing:
+                    missing.append(value)
+        return "".join(parts), missing
+
+class TemplateValidationError(ValueError):
+    """必填字段缺失，不值得再调用 Gemini"""
+
+    def __init__(self, template_type, missing):
+        self.template_type = template_type
+        self.missing = missing
+        super().__init__(f"模板 {template_type} 缺少必填字段：{', '.join(missing)}")
+
+DEFAULT_SENDER = "Student Service Center"
+
+# 各模板在用户未填写时使用的默认值
+TEMPLATE_DEFAULTS = {
+    "course_registration": {"name": DEFAULT_SENDER},
+    "event_notice": {
+        "registration": {
+            "de": "Eine Anmeldung ist nicht erforderlich.",
+            "en": "Registration is not required.",
+        },
+        "name": DEFAULT_SENDER,
+    },
+    "schedule_request": {
+        "time_options": {
+            "de": "Derzeit liegen keine konkreten Zeitoptionen vor.",
+            "en": "Currently, there are no specific time options available.",
+        },
+        "name": DEFAULT_SENDER,
+    },
+    "schedule_announcement": {"name": DEFAULT_SENDER},
+    "schedule_change": {
+        "new_time": {"de": "Keine Änderung", "en": "No change"},
+        "new_location": {"de": "Keine Änderung", "en": "No change"},
+        "name": DEFAULT_SENDER,
+    },
+    "holiday_notice": {"name": DEFAULT_SENDER},
+}
+
+# 各模板的必填字段，缺失时直接报错而不调用 Gemini
+TEMPLATE_REQUIRED_FIELDS = {
+    "event_notice": ["event_name"],
+    "schedule_request": ["course_name"],
+    "schedule_announcement": ["course_name"],
+    "schedule_change": ["course_name"],
+}
+
+class TemplateRegistry:
+    """
+    模板注册表：启动时一次性加载 data/ 下所有 .txt 模板（按文件名索引，如 schedule_change），
+    之后通过轮询 mtime 发现新增、修改或删除的模板并整体替换，请求处理时不再读文件。
+    模板按文件名查找，不同子目录中的同名文件只使用路径排序最靠前的一个，并打印警告。
+    """
+
+    def __init__(self, data_dir, poll_interval=2.0):
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+        self._templates = None  # name -> {"path", "category", "mtime", "template"}，首次使用时加载
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._duplicates = {}  # 上次扫描发现的重名模板，变化时才重新警告
+
+    def _scan(self):
+        found = {}
+        duplicates = {}
+        for root, dirs, files in os.walk(self.data_dir):
+            # 固定遍历顺序，重名时选中的文件不随文件系统而变
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith('.txt'):
+                    path = os.path.join(root, filename)
+                    name = os.path.splitext(filename)[0]
+                    if name in found:
+                        duplicates.setdefault(name, [found[name][0]]).append(path)
+                        continue
+                    found[name] = (path, os.path.getmtime(path))
+        if duplicates != self._duplicates:
+            for name, paths in duplicates.items():
+                print(f"模板 {name} 重名：{', '.join(paths)}，只使用 {paths[0]}")
+            self._duplicates = duplicates
+        return found
+
+    def reload(self):
+        """重新扫描模板目录，只重新读取有变化的文件；返回发生变化的模板名列表"""
+        with self._lock:
+            current = self._templates or {}
+            updated = {}
+            changed = []
+            for name, (path, mtime) in self._scan().items():
+                old = current.get(name)
+                if old and old["path"] == path and old["mtime"] == mtime:
+                    updated[name] = old
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8') as file:
+                        text = file.read()
+                except Exception as e:
+                    print(f"读取模板 {path} 时发生错误：{str(e)}")
+                    if old:
+                        updated[name] = old
+                    continue
+                updated[name] = {
+                    "path": path,
+                    "category": os.path.basename(os.path.dirname(path)),
+                    "mtime": mtime,
+                    "template": CompiledTemplate(text),
+                }
+                changed.append(name)
+            changed.extend(name for name in current if name not in updated)
+            # 整体替换引用，读取方要么看到旧版本要么看到新版本
+            self._templates = updated
+        return changed
+
+    def _loaded(self):
+        if self._templates is None:
+            self.reload()
+        return self._templates
+
+    def get(self, name):
+        """返回已编译的模板（CompiledTemplate），不存在时返回 None"""
+        entry = self._loaded().get(name)
+        return entry["template"] if entry else None
+
+    def names(self):
+        return sorted(self._loaded())
+
+    def start_watching(self):
+        """启动后台线程轮询模板目录（重复调用无副作用）"""
+        if self._watcher is not None:
+            return
+        def watch():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    changed = self.reload()
+                    if changed:
+                        print(f"模板已重新加载：{', '.join(changed)}")
+                except Exception as e:
+                    print(f"轮询模板目录时发生错误：{str(e)}")
+        self._watcher = threading.Thread(target=watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+
+templates = TemplateRegistry(DATA_DIR, poll_interval=float(os.getenv('TEMPLATE_POLL_INTERVAL', '2')))
+
+def fill_template(template_type, **values):
+    """
+    按模板类型渲染模板，返回 (渲染结果, 未填写的占位符列表)；模板不存在时返回 None。
+    必填字段缺失时抛出 TemplateValidationError。
+    """
+    missing_required = [f for f in TEMPLATE_REQUIRED_FIELDS.get(template_type, []) if not values.get(f)]
+    if missing_required:
+        raise TemplateValidationError(template_type, missing_required)
+    template = templates.get(template_type)
+    if template is None:
+        print(f"未找到模板：{template_type}")
         return None
+    return template.render(values, TEMPLATE_DEFAULTS.get(template_type))
+
+# ---------- 本地格式化与确定性快速路径 ----------
+
+MONTHS = {
+    "de": ["Januar", "Februar", "März", "April", "Mai", "Juni",
+           "Juli", "August", "September", "Oktober", "November", "Dezember"],
+    "en": ["January", "February", "March", "April", "May", "June",
+           "July", "August", "September", "October", "November", "December"],
+}
+
+# 日期（DD.MM.YYYY、D.M.YYYY 或 YYYY-MM-DD），可带时间段，如 "27.06.2025, 10:00–12:00"
+DATE_PATTERN = re.compile(
+    r'^\s*(?:(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})'
+    r'|(?P<iso_year>\d{4})-(?P<iso_month>\d{2})-(?P<iso_day>\d{2}))'
+    r'(?P<time>,?\s+\d{1,2}[:.]\d{2}(?:\s*[-–]\s*\d{1,2}[:.]\d{2})?)?\s*$'
+)
 
-    # 替换模板变量
-    if not registration:
-        registration = "Registration is not required."
-        
-    if event_name:
-        template = template.replace("{event_name}", event_name)
-    if event_intro:
-        template = template.replace("{event_intro}", event_intro)
-    if event_time:
-        template = template.replace("{event_time}", event_time)
-    if language:
-        template = template.replace("{language}", language)
-    if event_location:
-        template = template.replace("{event_location}", event_location)
-    if target_group:
-        template = template.replace("{target_group}", target_group)
-    if registration:
-        template = template.replace("{registration}", registration)
-    if name:
-        template = template.replace("{name}", name)
-    else:
-        template = template.replace("{name}", "Student Service Center")
-
-    # 构造 prompt 交给 Gemini
-    prompt = f"""
-    请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
-    保持所有格式和标记（如 **、换行等）不变。
-    如果模板中有未替换的变量（如 {{event_name}}），请保持原样。
-    如果模板中{{event_time}}为空，请替换为"待定"，翻译为德英版本对应语言，不要简写。
-    如果用户写入until + 日期，或者 bis + 日期，或者其他格式的日期，请识别并添加。
-    如果模板中{{target_group}}未被添加，默认添加为所有人。
-    如果模板中{{name}}未被添加，默认添加为Student Service Center。
-    确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字。
-    请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+LANGUAGE_NAMES = {
+    "english": {"de": "Englisch", "en": "English"},
+    "englisch": {"de": "Englisch", "en": "English"},
+    "german": {"de": "Deutsch", "en": "German"},
+    "deutsch": {"de": "Deutsch", "en": "German"},
+}
 
+def format_date(value):
+    """
+    把日期转换为两种语言的写法，例如 {"de": "15. Juli 2025", "en": "15 July 2025"}。
+    无法识别时返回 None。
+    """
+    match = DATE_PATTERN.match(value or "")
+    if not match:
+        return None
+    try:
+        if match.group("day"):
+            date = datetime.date(int(match.group("year")), int(match.group("month")), int(match.group("day")))
+        else:
+            date = datetime.date(int(match.group("iso_year")), int(match.group("iso_month")), int(match.group("iso_day")))
+    except ValueError:
+        return None
+    time_part = match.group("time") or ""
+    return {
+        "de": f"{date.day:02d}. {MONTHS['de'][date.month - 1]} {date.year}{time_part}",
+        "en": f"{date.day:02d} {MONTHS['en'][date.month - 1]} {date.year}{time_part}",
+    }
+
+def is_language_neutral(value):
+    """不含需要翻译的单词（只有数字、符号、缩写或编号）的文本无需翻译"""
+    for word in re.findall(r'[^\W\d_]+', value):
+        if len(word) > 2 and not word.isupper():
+            return False
+    return True
+
+# 各模板字段的类型：date 为日期，text 为需要翻译的自由文本（目标群体、地点也属于此类，
+# 只有 "MI HS1" 这样的编号才能原样放进两种语言），其余字段（人名、课程名、课程编号等）原样使用
+TEMPLATE_FIELD_KINDS = {
+    "course_registration": {"time_start": "date", "time_end": "date", "note": "text", "target_group": "text"},
+    "event_notice": {
+        "event_time": "date", "event_intro": "text", "language": "language", "registration": "text",
+        "event_location": "text", "target_group": "text",
+    },
+    "schedule_request": {"semester": "text", "time_options": "text", "reply_deadline": "date", "target_group": "text"},
+    "schedule_announcement": {
+        "course_start_date": "date", "weekly_time": "text", "weekly_location": "text", "target_group": "text",
+    },
+    "schedule_change": {
+        "change_reason": "text", "original_time": "date", "new_time": "date",
+        "original_location": "text", "new_location": "text", "target_group": "text",
+    },
+}
+
+# 可以省略的字段：为空时整行删除（例如课程注册通知中的备注行）
+TEMPLATE_OPTIONAL_FIELDS = {
+    "course_registration": ["note"],
+}
+
+def render_deterministic(template_type, values):
+    """
+    当所有占位符都能在本地规范化时（日期可识别、自由文本无需翻译），直接渲染模板，无需调用 Gemini。
+    否则返回 None，由 Gemini 负责翻译和规范化。
+    """
+    template = templates.get(template_type)
+    kinds = TEMPLATE_FIELD_KINDS.get(template_type)
+    if template is None or kinds is None:
+        return None
+    optional = TEMPLATE_OPTIONAL_FIELDS.get(template_type, [])
+    localized = {}
+    for field, value in values.items():
+        if not value:
+            if field in optional:
+                localized[field] = "\0"
+            continue
+        kind = kinds.get(field)
+        if kind == "date":
+            value = format_date(value)
+        elif kind == "language":
+            value = LANGUAGE_NAMES.get(value.strip().lower())
+        elif kind == "text" and not is_language_neutral(value):
+            value = None
+        if value is None:
+            return None
+        localized[field] = value
+    text, missing = template.render(localized, TEMPLATE_DEFAULTS.get(template_type))
+    if missing:
+        return None
+    lines = []
+    skip_blank = False
+    for line in text.split("\n"):
+        if "\0" in line:
+            # 删除空字段所在行，以及随之多出来的空行
+            skip_blank = bool(lines) and not lines[-1].strip()
+            continue
+        if skip_blank and not line.strip():
+            skip_blank = False
+            continue
+        skip_blank = False
+        lines.append(line)
+    return "\n".join(lines)
+
+class SQLiteCacheStore:
+    """
+    响应缓存的共享层（SQLite，WAL 模式）：重启后仍然有效，同一台机器上的多个 worker 进程共用，
+    一个进程生成的结果其他进程也能命中。条目为 (文本, 创建时间, 生成耗时)。
+    过期条目和超出 max_entries 的最旧条目在打开时和每 prune_every 次写入后删除，文件大小有上限。
+    其他进程正在写入时最多等待 timeout 秒，仍然拿不到锁就按未命中处理（写入则放弃），缓存不应拖慢请求。
+    """
 
-    模板内容：
-    {template}
+    def __init__(self, db_path, ttl=24 * 3600, max_entries=10000, prune_every=100, timeout=1.0):
+        self._db = SQLiteDatabase(db_path, timeout=timeout)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        self._ready = False
+
+    def _connect(self):
+        # 首次使用时才建表，导入 core 时不创建数据库文件
+        conn = self._db.connect()
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, elapsed REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)"
+            )
+            self._ready = True
+            self.prune()
+        return conn
+
+    def prune(self):
+        """删除过期条目，以及超出 max_entries 的最旧条目，返回删除数量"""
+        with self._db.transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        return removed
+
+    def get(self, key):
+        """返回未过期的条目，不存在或数据库被锁定时返回 None"""
+        try:
+            return self._connect().execute(
+                "SELECT value, created_at, elapsed FROM response_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"读取响应缓存失败，按未命中处理：{e}")
+            return None
+
+    def set(self, key, entry):
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at, elapsed) VALUES (?, ?, ?, ?)",
+                (key, *entry)
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self.prune()
+        except sqlite3.OperationalError as e:
+            print(f"写入响应缓存失败，已跳过：{e}")
+
+class ResponseCache:
+    """
+    模板生成结果缓存：进程内 LRU + TTL 淘汰，可选共享层 store（如 SQLiteCacheStore）。
+    进程内只保存近期用过的条目，未命中时再查共享层；多进程部署时各进程的结果通过共享层互通。
+    共享层的读写在线程中执行，等待其他进程的写锁时不阻塞事件循环；过期条目由共享层自己清理。
+    键由模板类型、替换后的模板文本、提示词和模型名共同决定，同一个键的内容不会变化，
+    因此进程内的条目不需要与其他进程同步失效。
     """
-    print("\n正在生成活动通知...")
 
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return response.text.replace('\n', '<br>')
+    def __init__(self, max_entries=512, ttl=24 * 3600, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, created_at, elapsed)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.store = store
+
+    @staticmethod
+    def make_key(template_type, template, prompt, model, context=None):
+        digest = hashlib.sha256()
+        for part in (template_type, template, prompt, model, context):
+            digest.update((part or "").encode('utf-8'))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def get(self, key):
+        """命中返回缓存文本，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                entry = None
+        if entry is None and self.store is not None:
+            entry = await asyncio.to_thread(self.store.get, key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(key, entry)
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+    async def set(self, key, value, elapsed=0.0):
+        entry = (value, time.time(), elapsed)
+        with self._lock:
+            self._store(key, entry)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.set, key, entry)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / total if total else 0.0,
+                "savedSeconds": round(self.saved_seconds, 3),
+            }
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+# 缓存配置：RESPONSE_CACHE_DB 为空时只使用进程内缓存（多 worker 部署时由 main.py 默认设置为共享的 SQLite 文件），
+# RESPONSE_CACHE_DB_SIZE 是数据库中最多保留的条目数
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB') or None
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', str(24 * 3600)))
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '512')),
+    ttl=RESPONSE_CACHE_TTL,
+    store=SQLiteCacheStore(
+        RESPONSE_CACHE_DB, ttl=RESPONSE_CACHE_TTL,
+        max_entries=int(os.getenv('RESPONSE_CACHE_DB_SIZE', '10000')),
+        timeout=float(os.getenv('RESPONSE_CACHE_DB_TIMEOUT', '1')),
+    ) if RESPONSE_CACHE_DB else None,
+)
 
-    except Exception as e:
-        print(f"\n发生错误：{str(e)}")
+async def lookup_cache(template_type, key, bypass_cache=False):
+    """查询响应缓存并记录命中情况；bypass_cache 时不查询，直接返回 None"""
+    if bypass_cache:
+        metrics.CACHE_REQUESTS.inc(template_type=template_type, result="bypass")
         return None
+    with metrics.GENERATION_STAGE_SECONDS.time(template_type=template_type, stage="cache"):
+        cached = await response_cache.get(key)
+    metrics.CACHE_REQUESTS.inc(template_type=template_type, result="miss" if cached is None else "hit")
+    return cached
 
-def process_schedule_request(course_name=None, course_code=None, semester=None, time_options=None, reply_deadline=None, name=None, target_group=None):
+async def generate_cached(template_type, template, prompt, bypass_cache=False, model=GEMINI_MODEL, context=None):
     """
-    读取排课协调模板并生成发送给教职工的邮件
+    带缓存的模板生成。
+    返回 (生成文本, 缓存状态)，缓存状态为 hit / miss / bypass。
+    """
+    key = ResponseCache.make_key(template_type, template, prompt, model, context)
+    cached = await lookup_cache(template_type, key, bypass_cache)
+    if cached is not None:
+        return cached, "hit"
+    started = time.perf_counter()
+    with metrics.GENERATION_STAGE_SECONDS.time(template_type=template_type, stage="llm"):
+        text = await generate_text(prompt, model, context, template_type)
+    await response_cache.set(key, text, elapsed=time.perf_counter() - started)
+    return text, "bypass" if bypass_cache else "miss"
+
+# 双语通知拆成德语、英语两次并发调用，耗时约为较长的一半；BILINGUAL_SPLIT=1 时默认启用，也可按请求开启
+BILINGUAL_SPLIT = os.getenv('BILINGUAL_SPLIT', '0') == '1'
+
+def split_plan(plan):
     """
-    file_path = './data/Staff/schedule_request.txt'
+    把双语生成计划拆成德语和英语两个子计划，模板中两部分之外的内容（顶部提示、分隔线）原样保留。
+    子计划的 context 只包含对应语言的模板部分，prompt（字段值）不变。
+    返回 (之前的内容, {"de": 子计划, "en": 子计划}, 两部分之间的内容, 之后的内容)；
+    模板无法拆分时返回 None，由调用方按单次调用生成。
+    """
+    template = plan["template"]
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取模板文件时发生错误：{str(e)}")
+        before, de, _ = locate_section(template, "de")
+        de_before, en, after = locate_section(template, "en")
+        contexts = {language: build_template_context(plan["template_type"], language) for language in ("de", "en")}
+    except ValueError:
+        return None
+    between = template[len(before) + len(de):len(de_before)]
+    plans = {
+        language: {
+            "template_type": f"{plan['template_type']}:{language}",
+            "template": section,
+            "context": contexts[language],
+            "prompt": plan["prompt"],
+        }
+        for language, section in (("de", de), ("en", en))
+    }
+    return before, plans, between, after
+
+def use_split(split_languages, regenerate):
+    """是否按语言拆分：请求未指定时使用 BILINGUAL_SPLIT；只重新生成一种语言时必须拆分"""
+    if regenerate:
+        return True
+    return BILINGUAL_SPLIT if split_languages is None else split_languages
+
+async def run_generation(plan, bypass_cache=False, split_languages=None, regenerate=None):
+    """
+    执行 prepare_* 返回的生成计划，content 为 Markdown 原文（由 main.py 在返回时渲染为 HTML）。
+    快速路径直接返回模板结果，否则调用 Gemini（带缓存）。
+    split_languages 为 True 时德语和英语部分并发生成后拼接，各自单独缓存；
+    regenerate 为 de / en 时只有这一种语言跳过缓存，另一种语言未变化时直接使用缓存结果。
+    模板不存在时返回 None，Gemini 调用失败时抛出 LLMError。
+    """
+    if plan is None:
         return None
+    template_type = plan["template_type"]
+    if "content" in plan:
+        return {"content": plan["content"], "cache": "skip", "missing": [], "path": "template"}
+
+    parts = split_plan(plan) if use_split(split_languages, regenerate) else None
+    if parts is None:
+        with metrics.GENERATION_SECONDS.time(template_type=template_type, path="llm"):
+            content, cache_status = await generate_cached(
+                template_type, plan["template"], plan["prompt"], bypass_cache, context=plan.get("context")
+            )
+        return {"content": content, "cache": cache_status, "missing": plan["missing"], "path": "llm"}
+
+    before, plans, between, after = parts
+    with metrics.GENERATION_SECONDS.time(template_type=template_type, path="llm_split"):
+        (de_text, de_status), (en_text, en_status) = await asyncio.gather(*(
+            generate_cached(
+                sub["template_type"], sub["template"], sub["prompt"],
+                bypass_cache or regenerate == language, context=sub["context"]
+            )
+            for language, sub in plans.items()
+        ))
+        content = before + de_text.strip() + between + en_text.strip() + after
+    return {
+        "content": content,
+        "cache": de_status if de_status == en_status else "partial",
+        "languages": {"de": de_status, "en": en_status},
+        "missing": plan["missing"],
+        "path": "llm_split",
+    }
 
-    # 替换变量
-    if target_group:
-        template = template.replace("{target_group}", target_group)
-    if course_name:
-        template = template.replace("{course_name}", course_name)
-    if course_code:
-        template = template.replace("{course_code}", course_code)
-    if semester:
-        template = template.replace("{semester}", semester)
-    if time_options:
-        template = template.replace("{time_options}", time_options)
-    else:
-        template = template.replace(
-        "{time_options}",
-        "Derzeit liegen keine konkreten Zeitoptionen vor.\n\nCurrently, there are no specific time options available."
+async def stream_cached(plan, bypass_cache=False):
+    """流式生成单个计划（带缓存），逐块产出原始文本；结束后写入缓存"""
+    context = plan.get("context")
+    key = ResponseCache.make_key(plan["template_type"], plan["template"], plan["prompt"], GEMINI_MODEL, context)
+    cached = await lookup_cache(plan["template_type"], key, bypass_cache)
+    if cached is not None:
+        yield cached
+        return
+    started = time.perf_counter()
+    chunks = []
+    async for chunk in generate_text_stream(plan["prompt"], context=context):
+        chunks.append(chunk)
+        yield chunk
+    await response_cache.set(key, "".join(chunks), elapsed=time.perf_counter() - started)
+
+async def stream_generation(plan, bypass_cache=False, split_languages=None, regenerate=None):
+    """
+    流式执行生成计划，逐块产出 Markdown 原文（由 main.py 的 sse_response 渲染为 HTML）。
+    缓存命中和快速路径一次性产出全部内容；流式生成结束后写入缓存。
+    按语言拆分时英语部分在后台同时生成，德语部分流式输出完毕后紧接着输出英语部分。
+    """
+    if "content" in plan:
+        yield plan["content"]
+        return
+    parts = split_plan(plan) if use_split(split_languages, regenerate) else None
+    if parts is None:
+        async for chunk in stream_cached(plan, bypass_cache):
+            yield chunk
+        return
+
+    before, plans, between, after = parts
+    en = plans["en"]
+    en_task = asyncio.ensure_future(
+        generate_cached(
+            en["template_type"], en["template"], en["prompt"],
+            bypass_cache or regenerate == "en", context=en["context"]
+        )
     )
+    try:
+        yield before
+        async for chunk in stream_cached(plans["de"], bypass_cache or regenerate == "de"):
+            yield chunk
+        en_text, _ = await en_task
+        yield between + en_text.strip() + after
+    finally:
+        en_task.cancel()
+
+# ---------- 模板生成的提示词 ----------
+# 每种模板的静态指令。指令和原始模板（带占位符）组成可缓存的 context，
+# 每次请求只发送字段值，避免重复发送大段相同的内容。
+TEMPLATE_INSTRUCTIONS = {
+    "course_registration": """
+请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
+如果 note 为空，则**Hinweis:**和**Note:**应该不显示。
+否则请将 note 内容添加在**Hinweis:**或者**Note:**后。
+无论 note 是什么语言，你都应该转化成信件相应的德语和英语，并使用相应的信件语言。
+保持所有格式标记（如 **、换行等）不变。
+如果模板中的变量没有提供值（如 {time_start}），请保持原样。
+如果{time_start}或者{time_end}没有提供，请添加为今天的日期。如果用户写入until + 日期，或者 bis + 日期，或者日期写成其他格式，你也应该识别出来。
+如果{target_group}没有提供，请添加为所有人。
+如果{name}没有提供，请添加为Student Service Center。
+确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM应为德语或英语月份（在德语版本为德语，在英语版本为英语），而不是数字。
+请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+""",
+    "event_notice": """
+请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
+保持所有格式和标记（如 **、换行等）不变。
+如果模板中的变量没有提供值（如 {event_name}），请保持原样。
+如果{event_time}为空，请替换为"待定"，翻译为德英版本对应语言，不要简写。
+如果用户写入until + 日期，或者 bis + 日期，或者其他格式的日期，请识别并添加。
+如果{target_group}没有提供，默认添加为所有人。
+如果{name}没有提供，默认添加为Student Service Center。
+确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字。
+请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+""",
+    "schedule_request": """
+请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
+模板中所有变量（如 {semester}, {course_name}, {course_code}, {time_options}, {reply_deadline}, {name}, {target_group}）必须全部替换为提供的参数值，并且翻译为德语和英语；
+如果用户写入until + 日期，或者 bis + 日期，或者其他格式的日期，请识别并添加在{reply_deadline};
+确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字;
+请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+输出必须严格保留原有格式，包括称呼、空行、加粗标记（**）及段落结构；
+输出应为纯文本格式，德英两部分之间以横线 `---` 分隔；
+""",
+    "schedule_announcement": """
+请严格按照以下模板格式生成德英双语课程通知,不要添加其他任何额外的内容或解释：
+所有变量应根据传入参数替换；保持换行符、列表符号、空格与加粗标记；不得添加HTML标签。
+确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字;
+德语版本翻译为德语，英语版本翻译为英语；
+如果{name}为空，默认为"Student Service Center";
+请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+""",
+    "schedule_change": """
+请严格按照以下模板格式生成课程时间变更通知,不要添加其他任何额外的内容或解释：
+德语和英语双语格式：
+所有变量均需替换；
+格式保持原样，不得添加解释或HTML；
+日期统一使用DD.MM.YYYY格式，并翻译月份；
+如果{new_location}或者{new_time}为空，替换为"没有变化"，并翻译为不同版本的对应语言；
+如果{name}为空，默认为"Student Service Center";
+请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+""",
+}
+
+SINGLE_LANGUAGE_INSTRUCTION = """
+注意：上面的模板只是双语通知中的{language}部分，请只生成这一部分，
+不要生成另一种语言的版本，也不要添加分隔线或 "Scroll down for English version" 提示。
+"""
 
-    if reply_deadline:
-        template = template.replace("{reply_deadline}", reply_deadline)
-    if name:
-        template = template.replace("{name}", name)
-    else:
-        template = template.replace("{name}", "Student Service Center")
-
-    # 构造提示
-    prompt = f"""
-    请严格按照以下模板格式生成通知,不要添加其他任何额外的内容或解释：
-    模板中所有变量（如 {{semester}}, {{course_name}}, {{course_code}}, {{time_options}}, {{reply_deadline}}, {{name}}, {{target_group}}）必须全部替换为提供的参数值，并且翻译为德语和英语；
-    如果用户写入until + 日期，或者 bis + 日期，或者其他格式的日期，请识别并添加在{reply_deadline};
-    确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字;
-    请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
-    输出必须严格保留原有格式，包括称呼、空行、加粗标记（**）及段落结构；
-    输出应为纯文本格式，德英两部分之间以横线 `---` 分隔；
+def build_template_context(template_type, language=None):
+    """
+    模板生成的静态部分：指令加原始模板（带占位符），同一模板的所有请求完全相同，可以整体缓存。
+    language 为 de / en 时只包含该语言的模板部分；无法拆分时抛出 ValueError。
+    """
+    text = templates.get(template_type).text
+    suffix = ""
+    if language:
+        _, text, _ = locate_section(text, language)
+        suffix = SINGLE_LANGUAGE_INSTRUCTION.format(language=EDIT_SECTIONS[language])
+    return f"{TEMPLATE_INSTRUCTIONS[template_type].strip()}\n\n模板内容：\n{text}\n{suffix}"
 
-    模板内容：
-    {template}
+def build_field_prompt(template_type, values):
     """
+    模板生成的变化部分：本次请求的字段值（JSON）。
+    空字段使用模板默认值，仍为空的字段不列出，由模型按指令处理。
+    """
+    defaults = TEMPLATE_DEFAULTS.get(template_type, {})
+    fields = {}
+    for name in templates.get(template_type).placeholders:
+        value = values.get(name) or defaults.get(name)
+        if value:
+            fields[name] = value
+    return (
+        "字段值（JSON，{\"de\": ..., \"en\": ...} 形式的值按语言分别使用）：\n"
+        + json.dumps(fields, ensure_ascii=False, indent=1)
+        + "\n请用这些值替换模板中的同名变量，输出完整的通知。"
+    )
 
-    print("\n正在生成排课协调邮件...")
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return response.text.replace('\n', '<br>')
-    except Exception as e:
-        print(f"\n发生错误：{str(e)}")
-        return None
+def template_plan(template_type, template, values, missing):
+    """需要调用 LLM 的生成计划；template 为本地渲染结果，用于缓存键和按语言拆分"""
+    return {
+        "template_type": template_type,
+        "template": template,
+        "context": build_template_context(template_type),
+        "prompt": build_field_prompt(template_type, values),
+        "missing": missing,
+    }
 
-def process_schedule_announcement(course_name=None, course_code=None, instructor_name=None, course_start_date=None, weekly_time=None, weekly_location=None, target_group=None, name=None):
+def prepare_course_registration(time_start=None, time_end=None, target_group=None, name=None, note=None):
     """
-    读取课程安排通知模板并生成邮件内容
+    读取课程注册信息并生成通知
+    返回生成计划，由 run_generation / stream_generation 执行
     """
-    file_path = './data/Student/schedule_announcement.txt'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取模板文件时发生错误：{str(e)}")
+    # 备注随请求传入，不再经过共享的 note.txt 文件
+    note_content = note.strip() if note else None
+
+    values = dict(
+        time_start=time_start,
+        time_end=time_end,
+        target_group=target_group,
+        name=name,
+        note=note_content
+    )
+    filled = fill_template("course_registration", **values)
+    if filled is None:
         return None
+    template, missing = filled
 
-    if course_name:
-        template = template.replace("{course_name}", course_name)
-    if course_code:
-        template = template.replace("{course_code}", course_code)
-    if instructor_name:
-        template = template.replace("{instructor_name}", instructor_name)
-    if course_start_date:
-        template = template.replace("{course_start_date}", course_start_date)
-    if weekly_time:
-        template = template.replace("{weekly_time}", weekly_time)
-    if weekly_location:
-        template = template.replace("{weekly_location}", weekly_location)
-    if target_group:
-        template = template.replace("{target_group}", target_group)
-    if name:
-        template = template.replace("{name}", name)
-    else:
-        template = template.replace("{name}", "Student Service Center")
-
-    prompt = f"""
-    请严格按照以下模板格式生成德英双语课程通知,不要添加其他任何额外的内容或解释：
-    所有变量应根据传入参数替换；保持换行符、列表符号、空格与加粗标记；不得添加HTML标签。
-    确保日期格式统一，为DD.MM.YYYY并在输出中突出显示。其中MM翻译为对应语言的月份表达,而不是数字;
-    德语版本翻译为德语，英语版本翻译为英语；
-    如果{name}为空，默认为"Student Service Center";
-    请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；    
-
-    模板内容：
-    {template}
-    """
-
-    print("\n正在生成课程安排通知...")
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return response.text.replace('\n', '<br>')
-    except Exception as e:
-        print(f"\n发生错误：{str(e)}")
-        return None
+    # 所有字段都能在本地规范化时直接返回模板结果，不调用 Gemini
+    content = render_deterministic("course_registration", values)
+    if content is not None:
+        return {"template_type": "course_registration", "content": content, "missing": []}
+
+    # 静态指令和模板作为可缓存的 context，本次请求只发送字段值
+    return template_plan("course_registration", template, values, missing)
 
-def process_schedule_change(course_name=None, reason=None, original_time=None, original_location=None, new_time=None, new_location=None, target_group=None, name=None, course_code=None):
+async def process_course_registration(*args, bypass_cache=False, **kwargs):
+    """生成课程注册通知，参数同 prepare_course_registration"""
+    return await run_generation(prepare_course_registration(*args, **kwargs), bypass_cache)
+
+def prepare_event_notice(event_name=None, event_intro=None, event_time=None, event_location=None, target_group=None, registration=None, language=None, name=None):
     """
-    课程变更通知
+    读取campus活动信息并生成通知
+    返回生成计划，由 run_generation / stream_generation 执行
     """
-    file_path = './data/All/schedule_change.txt'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取模板文件时发生错误：{str(e)}")
+    values = dict(
+        event_name=event_name,
+        event_intro=event_intro,
+        event_time=event_time,
+        language=language,
+        event_location=event_location,
+        target_group=target_group,
+        registration=registration,
+        name=name
+    )
+    filled = fill_template("event_notice", **values)
+    if filled is None:
         return None
+    template, missing = filled
 
-    if course_name:
-        template = template.replace("{course_name}", course_name)
-    if course_code:
-        template = template.replace("{course_code}", course_code)
-    if reason:
-        template = template.replace("{reason}", reason)
-    if original_time:
-        template = template.replace("{original_time}", original_time)
-    if original_location:
-        template = template.replace("{original_location}", original_location)
-    if new_time:
-        template = template.replace("{new_time}", new_time)
-    if new_location:
-        template = template.replace("{new_location}", new_location)
-    if target_group:
-        template = template.replace("{target_group}", target_group)
-    if name:
-        template = template.replace("{name}", name)
-    else:
-        template = template.replace("{name}", "Student Service Center")
-
-    prompt = f"""
-    请严格按照以下模板格式生成课程时间变更通知,不要添加其他任何额外的内容或解释：
-    德语和英语双语格式：
-    所有变量均需替换；
-    格式保持原样，不得添加解释或HTML；
-    日期统一使用DD.MM.YYYY格式，并翻译月份；
-    如果{new_location}或者{new_time}为空，替换为"没有变化"，并翻译为不同版本的对应语言；
-    如果{name}为空，默认为"Student Service Center";
-    请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
+    # 所有字段都能在本地规范化时直接返回模板结果，不调用 Gemini
+    content = render_deterministic("event_notice", values)
+    if content is not None:
+        return {"template_type": "event_notice", "content": content, "missing": []}
+
+    # 静态指令和模板作为可缓存的 context，本次请求只发送字段值
+    return template_plan("event_notice", template, values, missing)
 
-    模板内容：
-    {template}
+async def process_event_notice(*args, bypass_cache=False, **kwargs):
+    """生成活动通知，参数同 prepare_event_notice"""
+    return await run_generation(prepare_event_notice(*args, **kwargs), bypass_cache)
+
+def prepare_schedule_request(course_name=None, course_code=None, semester=None, time_options=None, reply_deadline=None, name=None, target_group=None):
+    """
+    读取排课协调模板并生成发送给教职工的邮件
+    返回生成计划，由 run_generation / stream_generation 执行
     """
+    values = dict(
+        target_group=target_group,
+        course_name=course_name,
+        course_code=course_code,
+        semester=semester,
+        time_options=time_options,
+        reply_deadline=reply_deadline,
+        name=name
+    )
+    filled = fill_template("schedule_request", **values)
+    if filled is None:
+        return None
+    template, missing = filled
 
-    print("\n正在生成课程时间变更通知...")
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return response.text.replace('\n', '<br>')
-    except Exception as e:
-        print(f"\n发生错误：{str(e)}")
+    # 所有字段都能在本地规范化时直接返回模板结果，不调用 Gemini
+    content = render_deterministic("schedule_request", values)
+    if content is not None:
+        return {"template_type": "schedule_request", "content": content, "missing": []}
+
+    # 静态指令和模板作为可缓存的 context，本次请求只发送字段值
+    return template_plan("schedule_request", template, values, missing)
+
+async def process_schedule_request(*args, bypass_cache=False, **kwargs):
+    """生成排课协调邮件，参数同 prepare_schedule_request"""
+    return await run_generation(prepare_schedule_request(*args, **kwargs), bypass_cache)
+
+def prepare_schedule_announcement(course_name=None, course_code=None, instructor_name=None, course_start_date=None, weekly_time=None, weekly_location=None, target_group=None, name=None):
+    """
+    读取课程安排通知模板并生成邮件内容
+    返回生成计划，由 run_generation / stream_generation 执行
+    """
+    values = dict(
+        course_name=course_name,
+        course_code=course_code,
+        instructor_name=instructor_name,
+        course_start_date=course_start_date,
+        weekly_time=weekly_time,
+        weekly_location=weekly_location,
+        target_group=target_group,
+        name=name
+    )
+    filled = fill_template("schedule_announcement", **values)
+    if filled is None:
         return None
+    template, missing = filled
 
-def process_free_prompt(prompt: str, tone: str = "neutral"):
-    """使用 Gemini 根据自由提示生成行政文案。
+    # 所有字段都能在本地规范化时直接返回模板结果，不调用 Gemini
+    content = render_deterministic("schedule_announcement", values)
+    if content is not None:
+        return {"template_type": "schedule_announcement", "content": content, "missing": []}
 
-    参数:
-        prompt: 用户输入的自由文本需求。
-        tone: 期望的语气，可选值为 neutral | friendly | firm。
+    # 静态指令和模板作为可缓存的 context，本次请求只发送字段值
+    return template_plan("schedule_announcement", template, values, missing)
 
-    返回:
-        str: 生成的 HTML 字符串，换行已转换为 <br>。
+async def process_schedule_announcement(*args, bypass_cache=False, **kwargs):
+    """生成课程安排通知，参数同 prepare_schedule_announcement"""
+    return await run_generation(prepare_schedule_announcement(*args, **kwargs), bypass_cache)
+
+def prepare_schedule_change(course_name=None, reason=None, original_time=None, original_location=None, new_time=None, new_location=None, target_group=None, name=None, course_code=None):
     """
-    if not prompt:
-        return ""
+    课程变更通知
+    返回生成计划，由 run_generation / stream_generation 执行
+    """
+    # 模板中的变更原因占位符为 {change_reason}
+    values = dict(
+        course_name=course_name,
+        course_code=course_code,
+        change_reason=reason,
+        original_time=original_time,
+        original_location=original_location,
+        new_time=new_time,
+        new_location=new_location,
+        target_group=target_group,
+        name=name
+    )
+    filled = fill_template("schedule_change", **values)
+    if filled is None:
+        return None
+    template, missing = filled
+
+    # 所有字段都能在本地规范化时直接返回模板结果，不调用 Gemini
+    content = render_deterministic("schedule_change", values)
+    if content is not None:
+        return {"template_type": "schedule_change", "content": content, "missing": []}
 
+    # 静态指令和模板作为可缓存的 context，本次请求只发送字段值
+    return template_plan("schedule_change", template, values, missing)
+
+async def process_schedule_change(*args, bypass_cache=False, **kwargs):
+    """生成课程时间变更通知，参数同 prepare_schedule_change"""
+    return await run_generation(prepare_schedule_change(*args, **kwargs), bypass_cache)
+
+def build_free_prompt(prompt: str, tone: str = "neutral"):
+    """构造自由提示生成所用的完整提示词"""
     # 根据语气添加前缀提示，帮助模型调整风格
     tone_map = {
         "neutral": "以正式且客观的语气撰写以下行政文档：",
@@ -354,7 +1467,7 @@ def process_free_prompt(prompt: str, tone: str = "neutral"):
     }
     prefix = tone_map.get(tone, tone_map["neutral"])
 
-    full_prompt = f"""
+    return f"""
 {prefix}
 
 {prompt}
@@ -362,90 +1475,145 @@ def process_free_prompt(prompt: str, tone: str = "neutral"):
 请生成德语版本后加横线 '---' 再生成英语版本。保持**加粗**与换行格式。
 """
 
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=full_prompt
-        )
-        content = response.text.replace("\n", "<br>")
-        return content
-    except Exception as e:
-        print(f"Gemini free prompt error: {e}")
-        # 回退：直接返回带前缀的原始提示
-        return f"AI生成内容： {prompt}"
+async def process_free_prompt(prompt: str, tone: str = "neutral"):
+    """使用 Gemini 根据自由提示生成行政文案。
 
-if __name__ == "__main__":
-    # 示例：可以传入参数来替换变量
-    result_course = process_course_registration(
-        time_start="2024-03-01",
-        time_end="2024-05-15",
-        target_group="Master in Informatics",
-        name="TUM Examination Office"
-    )
-    result_event = process_event_notice(
-        event_name="AI in Healthcare Forum",
-        event_intro="An insightful day full of keynotes, panels and startup showcases.",
-        registration="Anmeldung ist nicht erforderlich.",
-        language="english",
-        event_time="t.b.d.",
-        event_location="Audimax, TUM Main Campus",
-        target_group="All Master's students",
-        name="TUM AI Club",
-    )
-    result_schedule = process_schedule_request(
-        course_name="Advanced Data Analytics",
-        course_code="ADA-2025",
-        semester="2024/25 Winter",
-        time_options="- Montag, 10:00–12:00 Uhr\n- Dienstag, 14:00–16:00 Uhr",
-        reply_deadline="until 15.07.2025",
-        name="TUM Campus Heilbronn Coordination Team",
-        target_group="Professoren der Fakultät für Informatik"
-    )
+    参数:
+        prompt: 用户输入的自由文本需求。
+        tone: 期望的语气，可选值为 neutral | friendly | firm。
 
-    result_schedule_announcement = process_schedule_announcement(
-        course_name="Data-Driven Business Models",
-        course_code="DDBM-301",
-        instructor_name="Prof. Dr. Anna Schulz",
-        course_start_date="08.04.2025",
-        weekly_time="Montags, 14:00–16:00 Uhr",
-        weekly_location="H.3.024",
-        target_group="Bachelor in Management and Technology",
-        name="Student Service Center Heilbronn"
-    )
+    返回:
+        str: 生成的 Markdown 原文（由 main.py 渲染为 HTML）。
 
-    result_schedule_change = process_schedule_change(
-        course_name="Innovation Management",
-        course_code="INNO-501",
-        reason="aufgrund einer Überschneidung mit einer anderen Pflichtveranstaltung",
-        original_time="27.06.2025, 10:00–12:00 Uhr",
-        original_location="H.2.103",
-        new_time="27.06.2025, 12:00–14:00 Uhr",
-        new_location="H.2.205",
-        target_group="MSc Management",
-        name="Program Coordination MSc Management"
-    )
+    Gemini 调用失败时抛出 LLMError。
+    """
+    if not prompt:
+        return ""
 
-    if result_course:
-        print("\n=== 课程注册通知 ===\n")
-        print(result_course)
-    
-    if result_event:
-        print("\n=== 活动通知 ===\n")
-        print(result_event)
-    
-    if result_schedule:
-        print("\n=== 排课协调通知 ===\n")
-        print(result_schedule)
-    
-    if result_schedule_announcement:
-        print("\n=== 课程安排通知 ===\n")
-        print(result_schedule_announcement)
-    
-    if result_schedule_change:
-        print("\n=== 课程时间变更通知 ===\n")
-        print(result_schedule_change)
+    return await generate_text(build_free_prompt(prompt, tone))
+
+# 纯 LLM 生成的双语文本用单独一行 '---' 分隔德语和英语部分（文本或 HTML 换行均可）
+SECTION_SEPARATOR = re.compile(r'(?:^|\n|<br\s*/?>)[ \t]*-{3,}[ \t]*(?=\n|<br|$)')
 
+# 段落首尾的空白、换行、分隔线和“📩 Scroll down”提示行，定向编辑时原样保留，不交给模型
+LEADING_BREAKS = re.compile(r'^(?:\s|<br\s*/?>|-{3,}|📩[^<\n]*)*')
+TRAILING_BREAKS = re.compile(r'(?:\s|<br\s*/?>|-{3,})*$')
 
+EDIT_SECTIONS = {"de": "德语", "en": "英语"}
+
+def split_language_sections(content):
+    """
+    把双语草稿切分为德语和英语两部分，两部分直接拼接即为原文。
+    优先按 [English] 标记切分，否则按最后一个 '---' 分隔行切分；无法切分时返回 None。
+    """
+    index = content.find(ENGLISH_MARKER)
+    if index < 0:
+        matches = list(SECTION_SEPARATOR.finditer(content))
+        if not matches:
+            return None
+        index = matches[-1].end()
+    if not content[:index].strip() or not content[index:].strip():
+        return None
+    return content[:index], content[index:]
+
+def locate_section(content, section):
+    """
+    返回 (之前的内容, 目标部分, 之后的内容)，三者拼接即为原文。
+    目标部分不含首尾的空白和换行；找不到德语/英语部分时抛出 ValueError。
+    """
+    sections = split_language_sections(content)
+    if sections is None:
+        raise ValueError("无法在草稿中区分德语和英语部分")
+    de, en = sections
+    target = de if section == "de" else en
+    lead = LEADING_BREAKS.match(target).end()
+    trail = TRAILING_BREAKS.search(target, lead).start()
+    before = (target[:lead] if section == "de" else de + target[:lead])
+    after = (target[trail:] + en if section == "de" else target[trail:])
+    return before, target[lead:trail], after
+
+def build_gemini_edit_prompt(content: str, instruction: str, section=None):
+    """
+    构造草稿二次编辑所用的提示词（去掉首尾空白，使重复提交得到相同的提示词）。
+    section 为 de / en 时 content 只是文档的这一部分，模型只需改写并输出这一部分。
+    """
+    content, instruction = content.strip(), instruction.strip()
+    scope = ""
+    if section:
+        scope = f"\n以下只是双语文档中的{EDIT_SECTIONS[section]}部分，请只输出修改后的这一部分，不要补充另一种语言。\n"
+    return f"""
+你是一个行政文档写作助手。请根据用户的修改要求对以下草稿内容进行修改：
+{scope}
+【用户要求】：{instruction}
+
+【原始草稿】：
+{content}
+
+请严格保留原有文档的结构、格式（如加粗、换行、列表等），只做必要的内容调整。输出格式为 Markdown，直接换行，加粗请用 **，不要使用 HTML 标签，不要添加解释。
+"""
+
+async def process_gemini_edit(content: str, instruction: str, section=None):
+    """
+    使用 Gemini 根据用户要求对草稿（Markdown 原文）进行二次编辑，返回修改后的 Markdown 原文。
+    section 为 de / en 时只把这一部分发给模型，结果拼回原文，另一部分保持不变。
+    """
+    if section is None:
+        return await generate_text(build_gemini_edit_prompt(content, instruction))
+
+    before, target, after = locate_section(content, section)
+    response_text = await generate_text(build_gemini_edit_prompt(target, instruction, section))
+    return before + response_text.strip() + after
+
+async def _demo():
+    # 示例：可以传入参数来替换变量，多个通知并发生成
+    return await asyncio.gather(
+        process_course_registration(
+            time_start="2024-03-01",
+            time_end="2024-05-15",
+            target_group="Master in Informatics",
+            name="TUM Examination Office"
+        ),
+        process_event_notice(
+            event_name="AI in Healthcare Forum",
+            event_intro="An insightful day full of keynotes, panels and startup showcases.",
+            registration="Anmeldung ist nicht erforderlich.",
+            language="english",
+            event_time="t.b.d.",
+            event_location="Audimax, TUM Main Campus",
+            target_group="All Master's students",
+            name="TUM AI Club",
+        ),
+        process_schedule_request(
+            course_name="Advanced Data Analytics",
+            course_code="ADA-2025",
+            semester="2024/25 Winter",
+            time_options="- Montag, 10:00–12:00 Uhr\n- Dienstag, 14:00–16:00 Uhr",
+            reply_deadline="until 15.07.2025",
+            name="TUM Campus Heilbronn Coordination Team",
+            target_group="Professoren der Fakultät für Informatik"
+        ),
+        process_schedule_announcement(
+            course_name="Data-Driven Business Models",
+            course_code="DDBM-301",
+            instructor_name="Prof. Dr. Anna Schulz",
+            course_start_date="08.04.2025",
+            weekly_time="Montags, 14:00–16:00 Uhr",
+            weekly_location="H.3.024",
+            target_group="Bachelor in Management and Technology",
+            name="Student Service Center Heilbronn"
+        ),
+        process_schedule_change(
+            course_name="Innovation Management",
+            course_code="INNO-501",
+            reason="aufgrund einer Überschneidung mit einer anderen Pflichtveranstaltung",
+            original_time="27.06.2025, 10:00–12:00 Uhr",
+            original_location="H.2.103",
+            new_time="27.06.2025, 12:00–14:00 Uhr",
+            new_location="H.2.205",
+            target_group="MSc Management",
+            name="Program Coordination MSc Management"
+        )
+    )
 
 #学生邮件问题回复
 
@@ -455,33 +1623,12 @@ def process_student_reply(student_name=None, name=None):
     请严格按照以下模板格式生成学生邮件问题回复,不要添加其他任何额外的内容或解释；
     请帮忙将用户输入的所有信息在英语版本中翻译为英文，在德语版本中翻译为德语；
     """
-    file_path = './data/Student/student_reply.txt'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取 student_reply 模板失败: {str(e)}")
+    filled = fill_template("student_reply", student_name=student_name, name=name)
+    if filled is None:
         return None
+    template, _ = filled
 
-    # 替换模板变量
-    if student_name:
-        template = template.replace("{student_name}", student_name)
-    if name:
-        template = template.replace("{name}", name)
-
-    return template.replace('\n', '<br>')
-
-if __name__ == "__main__":
-    # 示例：生成学生问题回复模板
-    result_student_reply = process_student_reply(
-        student_name="Max Mustermann",
-        name="TUM Helpdesk"
-    )
-
-    if result_student_reply:
-        print("\n=== 学生回复模板 ===\n")
-        print(result_student_reply)
-
+    return template
 
 #节假日放假通知
 
@@ -490,38 +1637,54 @@ def process_holiday_notice(holiday_name=None, holiday_date=None, name=None):
     """
     节假日放假通知
     """
-    file_path = './data/All/holiday_notice.txt'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            template = file.read()
-    except Exception as e:
-        print(f"读取 holiday_notice 模板失败: {str(e)}")
+    filled = fill_template("holiday_notice", holiday_name=holiday_name, holiday_date=holiday_date, name=name)
+    if filled is None:
         return None
+    template, _ = filled
 
-    if holiday_name:
-        template = template.replace("{holiday_name}", holiday_name)
-    if holiday_date:
-        template = template.replace("{holiday_date}", holiday_date)
-    if name:
-        template = template.replace("{name}", name)
-    else:
-        template = template.replace("{name}", "Student Service Center")
-
-    return template.replace('\n', '<br>')
-
-result_holiday = process_holiday_notice(
-    holiday_name="Tag der Deutschen Einheit",
-    holiday_date="03.10.2025",
-    name="TUM Helpdesk"
-)
+    return template
 
-if result_holiday:
-    print("\n=== 节假日放假通知 ===\n")
-    print(result_holiday)
+if __name__ == "__main__":
+    (result_course, result_event, result_schedule,
+     result_schedule_announcement, result_schedule_change) = asyncio.run(_demo())
 
+    if result_course:
+        print("\n=== 课程注册通知 ===\n")
+        print(result_course["content"])
+    
+    if result_event:
+        print("\n=== 活动通知 ===\n")
+        print(result_event["content"])
     
+    if result_schedule:
+        print("\n=== 排课协调通知 ===\n")
+        print(result_schedule["content"])
+    
+    if result_schedule_announcement:
+        print("\n=== 课程安排通知 ===\n")
+        print(result_schedule_announcement["content"])
     
+    if result_schedule_change:
+        print("\n=== 课程时间变更通知 ===\n")
+        print(result_schedule_change["content"])
 
+    # 示例：生成学生问题回复模板
+    result_student_reply = process_student_reply(
+        student_name="Max Mustermann",
+        name="TUM Helpdesk"
+    )
 
+    if result_student_reply:
+        print("\n=== 学生回复模板 ===\n")
+        print(result_student_reply)
+
+    # 示例：生成节假日放假通知
+    result_holiday = process_holiday_notice(
+        holiday_name="Tag der Deutschen Einheit",
+        holiday_date="03.10.2025",
+        name="TUM Helpdesk"
+    )
 
-    
\ No newline at end of file
+    if result_holiday:
+        print("\n=== 节假日放假通知 ===\n")
+        print(result_holiday)
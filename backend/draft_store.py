@@ -0,0 +1,653 @@
+import os
+import re
+import time
+import html
+import json
+import unicodedata
+from uuid import uuid4
+import metrics
+from markup import html_to_markdown
+from sqlite_db import SQLiteDatabase
+
+
+class VersionConflict(Exception):
+    """草稿已被其他人修改：expected_version 与当前版本不一致"""
+
+    def __init__(self, draft_id, current_version):
+        super().__init__(f"草稿 {draft_id} 已被修改（当前版本 {current_version}）")
+        self.draft_id = draft_id
+        self.current_version = current_version
+
+
+class PatchError(ValueError):
+    """补丁格式错误，或路径不存在"""
+
+
+class PatchTestFailed(PatchError):
+    """JSON Patch 的 test 操作不成立"""
+
+
+def _parse_pointer(path):
+    """解析 JSON Pointer（RFC 6901），返回各级键"""
+    if path == "":
+        return []
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"无效的路径：{path}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def _resolve(doc, parts):
+    """返回路径最后一级的父容器和键（列表下标转换为 int，'-' 保留）"""
+    parent = doc
+    for part in parts[:-1]:
+        try:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchError(f"路径不存在：/{'/'.join(parts)}")
+    key = parts[-1]
+    if isinstance(parent, list) and key != "-":
+        if not key.isdigit():
+            raise PatchError(f"无效的列表下标：{key}")
+        key = int(key)
+    elif not isinstance(parent, (list, dict)):
+        raise PatchError(f"路径不存在：/{'/'.join(parts)}")
+    return parent, key
+
+
+def _get(doc, path):
+    parts = _parse_pointer(path)
+    if not parts:
+        return doc
+    parent, key = _resolve(doc, parts)
+    try:
+        return parent[key]
+    except (KeyError, IndexError, TypeError):
+        raise PatchError(f"路径不存在：{path}")
+
+
+def _remove(doc, path):
+    parts = _parse_pointer(path)
+    if not parts:
+        raise PatchError("不能删除整个草稿")
+    parent, key = _resolve(doc, parts)
+    try:
+        return parent.pop(key)
+    except (KeyError, IndexError, TypeError):
+        raise PatchError(f"路径不存在：{path}")
+
+
+def _add(doc, path, value):
+    parts = _parse_pointer(path)
+    if not parts:
+        return value
+    parent, key = _resolve(doc, parts)
+    if isinstance(parent, list):
+        if key == "-":
+            parent.append(value)
+        elif key > len(parent):
+            raise PatchError(f"列表下标越界：{path}")
+        else:
+            parent.insert(key, value)
+    else:
+        parent[key] = value
+    return doc
+
+
+def apply_json_patch(doc, operations):
+    """
+    应用 JSON Patch（RFC 6902），支持 add / remove / replace / move / copy / test。
+    在副本上操作，任何一步失败都不会修改原文档。
+    """
+    if not isinstance(operations, list):
+        raise PatchError("JSON Patch 必须是操作列表")
+    doc = json.loads(json.dumps(doc))
+    for operation in operations:
+        if not isinstance(operation, dict) or "path" not in operation:
+            raise PatchError(f"无效的补丁操作：{operation}")
+        op, path = operation.get("op"), operation["path"]
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"{op} 操作缺少 value")
+        if op == "add":
+            doc = _add(doc, path, operation["value"])
+        elif op == "remove":
+            _remove(doc, path)
+        elif op == "replace":
+            _get(doc, path)
+            parts = _parse_pointer(path)
+            if parts:
+                parent, key = _resolve(doc, parts)
+                parent[key] = operation["value"]
+            else:
+                doc = operation["value"]
+        elif op in ("move", "copy"):
+            if "from" not in operation:
+                raise PatchError(f"{op} 操作缺少 from")
+            value = _get(doc, operation["from"])
+            if op == "move":
+                _remove(doc, operation["from"])
+            else:
+                value = json.loads(json.dumps(value))
+            doc = _add(doc, path, value)
+        elif op == "test":
+            if _get(doc, path) != operation["value"]:
+                raise PatchTestFailed(f"test 失败：{path}")
+        else:
+            raise PatchError(f"不支持的补丁操作：{op}")
+    return doc
+
+
+def apply_merge_patch(doc, patch):
+    """应用 JSON Merge Patch（RFC 7386）：值为 null 的字段被删除，对象递归合并"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(doc) if isinstance(doc, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+# 建立全文索引前去掉 HTML 标签和 Markdown 加粗标记
+HTML_TAG = re.compile(r'<[^>]+>')
+SEARCH_TOKEN = re.compile(r'\w+')
+
+
+# 旧版生成结果是换行替换为 <br> 的 Markdown，除 <br> 外没有其他标签
+LEGACY_TAG = re.compile(r'<(?!br\s*/?>)[^>]+>', re.IGNORECASE)
+
+
+def legacy_to_markdown(draft):
+    """旧版 drafts.json 中由模型生成的草稿转换为 Markdown 原文；编辑器保存的 HTML 草稿原样保留"""
+    content = draft.get('content')
+    if not content or draft.get('contentFormat') or LEGACY_TAG.search(content):
+        return draft
+    return {**draft, 'content': html_to_markdown(content), 'contentFormat': 'markdown'}
+
+
+def searchable_text(value):
+    """把草稿正文转换为纯文本：去掉 <br>/<strong> 等标签和 **，并把 ß 统一为 ss"""
+    if not value:
+        return ""
+    text = html.unescape(HTML_TAG.sub(" ", str(value)))
+    return text.replace("**", " ").replace("ß", "ss").replace("ẞ", "SS")
+
+
+# 高亮时与索引一致地忽略大小写和变音符号
+FOLDED_LETTERS = {
+    "a": "[aäàáâ]", "o": "[oöòóô]", "u": "[uüùúû]", "e": "[eèéê]", "i": "[iìíî]", "c": "[cç]", "n": "[nñ]",
+}
+
+
+def highlight_pattern(query):
+    """搜索词的高亮正则：忽略大小写和变音符号，按前缀匹配；没有搜索词时返回 None"""
+    folded = unicodedata.normalize("NFKD", searchable_text(query).lower())
+    tokens = SEARCH_TOKEN.findall("".join(ch for ch in folded if not unicodedata.combining(ch)))
+    if not tokens:
+        return None
+    patterns = []
+    for token in tokens:
+        pattern = re.escape(token).replace("ss", "(?:ss|ß)")
+        patterns.append("".join(FOLDED_LETTERS.get(ch, ch) for ch in pattern) + r"\w*")
+    return re.compile("|".join(patterns), re.IGNORECASE)
+
+
+def make_snippet(text, matcher, width=80):
+    """
+    截取正文中第一个匹配词附近的片段，并用 <mark> 标出所有匹配词（已做 HTML 转义）。
+    在 Python 中处理最终返回的少量结果，比让 FTS5 为所有候选结果生成 snippet 快得多。
+    """
+    text = " ".join(html.unescape(HTML_TAG.sub(" ", text or "")).replace("**", "").split())
+    if not text or matcher is None:
+        return html.escape(text[:width * 2])
+    first = matcher.search(text)
+    start = max(0, first.start() - width) if first else 0
+    end = min(len(text), start + width * 2)
+    window = text[start:end]
+    parts = []
+    position = 0
+    for match in matcher.finditer(window):
+        parts.append(html.escape(window[position:match.start()]))
+        parts.append("<mark>" + html.escape(match.group()) + "</mark>")
+        position = match.end()
+    parts.append(html.escape(window[position:]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
+
+
+def build_match_query(query):
+    """
+    把用户输入转换为 FTS5 查询：多个词之间为 AND，最后一个词按前缀匹配（边输入边搜索）。
+    其余词按整词匹配：没有前缀索引时前缀查询需要合并所有同前缀的词，常见词会慢数倍。
+    用户输入中的 FTS5 语法字符（引号、括号、运算符）一律忽略，不会导致查询出错。
+    """
+    tokens = SEARCH_TOKEN.findall(searchable_text(query))
+    if not tokens:
+        return ""
+    return " ".join([f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+
+
+class DraftStore:
+    """
+    草稿存储接口。
+    main.py 只依赖这里定义的方法，具体后端可以通过 DRAFT_STORE 环境变量切换。
+    """
+
+    def query_drafts(self, limit=None, cursor=None, draft_type=None,
+                     created_from=None, created_to=None, fields=None):
+        """
+        按创建顺序倒序分页查询草稿。
+        cursor 为上一页返回的游标；fields 为需要返回的字段列表（id 总是返回）。
+        返回 (草稿列表, 下一页游标)，没有更多数据时游标为 None。
+        """
+        raise NotImplementedError
+
+    def get_draft(self, draft_id):
+        """返回指定草稿，不存在时返回 None"""
+        raise NotImplementedError
+
+    def create_draft(self, draft):
+        """保存新草稿并返回（带 id）"""
+        raise NotImplementedError
+
+    def update_draft(self, draft_id, fields, expected_version=None):
+        """合并更新草稿字段，不存在时返回 None"""
+        result = self.patch_draft(draft_id, lambda draft: {**draft, **fields}, expected_version)
+        return result[0] if result else None
+
+    def patch_draft(self, draft_id, apply, expected_version=None):
+        """
+        在同一个事务中读取草稿、调用 apply(草稿) 得到新内容并写回，版本号加一。
+        expected_version 与当前版本不一致时抛出 VersionConflict。
+        返回 (新草稿, 新版本号)，草稿不存在时返回 None。
+        """
+        raise NotImplementedError
+
+    def draft_version(self, draft_id):
+        """返回草稿的当前版本号，不存在时返回 None"""
+        raise NotImplementedError
+
+    def draft_revision(self, draft_id):
+        """返回 (版本号, 最后修改时间的 Unix 时间戳)，不存在时返回 None；用于条件请求"""
+        raise NotImplementedError
+
+    def store_revision(self):
+        """
+        返回 (修订号, 最后修改时间的 Unix 时间戳)：任何草稿被创建、修改或删除时修订号加一，
+        草稿列表据此判断客户端的缓存是否仍然有效。还没有任何修改时返回 (0, None)。
+        """
+        raise NotImplementedError
+
+    def delete_draft(self, draft_id):
+        """删除草稿，返回是否删除成功"""
+        raise NotImplementedError
+
+    def search_drafts(self, query, limit=20, draft_type=None, created_from=None, created_to=None):
+        """
+        全文搜索标题和正文，按相关度排序。
+        返回 (草稿摘要列表, 是否截断)，摘要包含 id、type、title、createdAt、snippet、score；
+        匹配结果过多、只在部分结果中排序时“是否截断”为 True。
+        """
+        raise NotImplementedError
+
+    def migrate_from_json(self, json_path):
+        """从旧版 drafts.json 导入草稿，返回导入数量；不支持的后端直接跳过"""
+        return 0
+
+
+class SQLiteDraftStore(DraftStore):
+    """
+    基于 SQLite（WAL 模式）的草稿存储。
+    id 上有唯一索引，读取和更新不再需要扫描全部草稿；
+    每个写操作都在 BEGIN IMMEDIATE 事务中完成，并发写同一草稿时会串行执行而不会互相覆盖。
+    标题和正文另有 FTS5 全文索引（drafts_fts，rowid 与 drafts.seq 对应），在同一事务中随草稿更新。
+    """
+
+    # 全文索引的结构版本，变化时启动时重建索引
+    FTS_VERSION = "1"
+    # 搜索时参与相关度排序的最新匹配结果数
+    SEARCH_CANDIDATES = 1000
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = SQLiteDatabase(db_path)
+        with self._db.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS drafts ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT NOT NULL UNIQUE, "
+                "type TEXT, "
+                "title TEXT, "
+                "created_at TEXT, "
+                "version INTEGER NOT NULL DEFAULT 1, "
+                "updated_at REAL, "
+                "data TEXT NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(drafts)")]
+            if 'updated_at' not in columns:
+                # 旧数据库：补上最后修改时间，已有草稿按创建时间计
+                conn.execute("ALTER TABLE drafts ADD COLUMN updated_at REAL")
+                conn.execute("UPDATE drafts SET updated_at = CAST(strftime('%s', created_at) AS REAL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_drafts_type ON drafts (type, seq)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_drafts_created_at ON drafts (created_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            # remove_diacritics 2：ä/ö/ü 等与不带变音符号的写法互相匹配
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS drafts_fts USING fts5("
+                "title, content, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            built = conn.execute(
+                "SELECT value FROM meta WHERE key = 'fts_version'"
+            ).fetchone()
+            if not built or built[0] != self.FTS_VERSION:
+                self._rebuild_search_index(conn)
+
+    def _rebuild_search_index(self, conn):
+        """为已有草稿重建全文索引（首次升级到带索引的版本时执行）"""
+        conn.execute("DELETE FROM drafts_fts")
+        for seq, data in conn.execute("SELECT seq, data FROM drafts").fetchall():
+            self._index(conn, seq, json.loads(data), replace=False)
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('fts_version', ?)", (self.FTS_VERSION,)
+        )
+
+    @staticmethod
+    def _index(conn, seq, draft, replace=True):
+        if replace:
+            conn.execute("DELETE FROM drafts_fts WHERE rowid = ?", (seq,))
+        conn.execute(
+            "INSERT INTO drafts_fts (rowid, title, content) VALUES (?, ?, ?)",
+            (seq, searchable_text(draft.get('title')), searchable_text(draft.get('content')))
+        )
+
+    @staticmethod
+    def _touch(conn, now):
+        """在写事务中把修订号加一并记录修改时间"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('revision', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('modified_at', ?)", (repr(now),))
+
+    @staticmethod
+    def _row_values(draft):
+        return (
+            draft.get('type'),
+            draft.get('title'),
+            draft.get('createdAt'),
+            json.dumps(draft, ensure_ascii=False),
+        )
+
+    def query_drafts(self, limit=None, cursor=None, draft_type=None,
+                     created_from=None, created_to=None, fields=None):
+        if fields:
+            # 只在 SQLite 中取出需要的字段，列表视图不必传输正文。
+            # 草稿中没有的字段不输出（与返回完整草稿时一致），值为 null 的字段照常输出；
+            # json_each 把 true / false 转成了 1 / 0，需要还原
+            names = ['id'] + [f for f in fields if f != 'id']
+            select = (
+                "(SELECT json_group_object(key, CASE type WHEN 'true' THEN json('true') "
+                "WHEN 'false' THEN json('false') ELSE value END) FROM json_each(data) "
+                f"WHERE key IN ({', '.join('?' * len(names))}))"
+            )
+            params = list(names)
+        else:
+            select = "data"
+            params = []
+
+        conditions = []
+        if cursor:
+            if not str(cursor).isdigit():
+                raise ValueError(f"无效的分页游标：{cursor}")
+            conditions.append("seq < ?")
+            params.append(int(cursor))
+        if draft_type:
+            conditions.append("type = ?")
+            params.append(draft_type)
+        if created_from:
+            conditions.append("created_at >= ?")
+            params.append(created_from)
+        if created_to:
+            conditions.append("created_at <= ?")
+            params.append(created_to)
+
+        sql = f"SELECT seq, {select} FROM drafts"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY seq DESC"
+        if limit:
+            # 多取一条用来判断是否还有下一页
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        rows = self._db.connect().execute(sql, params).fetchall()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][0])
+        return [json.loads(data) for _, data in rows], next_cursor
+
+    def get_draft(self, draft_id):
+        row = self._db.connect().execute(
+            "SELECT data FROM drafts WHERE id = ?", (draft_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create_draft(self, draft):
+        draft = {**draft, 'id': str(uuid4())}
+        now = time.time()
+        with self._db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO drafts (id, updated_at, type, title, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (draft['id'], now, *self._row_values(draft))
+            )
+            self._index(conn, cursor.lastrowid, draft, replace=False)
+            self._touch(conn, now)
+        return draft
+
+    def patch_draft(self, draft_id, apply, expected_version=None):
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                "SELECT data, version, seq FROM drafts WHERE id = ?", (draft_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if expected_version is not None and expected_version != row[1]:
+                raise VersionConflict(draft_id, row[1])
+            draft = {**apply(json.loads(row[0])), 'id': draft_id}
+            now = time.time()
+            conn.execute(
+                "UPDATE drafts SET type = ?, title = ?, created_at = ?, data = ?, "
+                "version = version + 1, updated_at = ? WHERE id = ?",
+                (*self._row_values(draft), now, draft_id)
+            )
+            self._index(conn, row[2], draft)
+            self._touch(conn, now)
+        return draft, row[1] + 1
+
+    def draft_version(self, draft_id):
+        row = self._db.connect().execute(
+            "SELECT version FROM drafts WHERE id = ?", (draft_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def draft_revision(self, draft_id):
+        row = self._db.connect().execute(
+            "SELECT version, updated_at FROM drafts WHERE id = ?", (draft_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def store_revision(self):
+        values = dict(self._db.connect().execute(
+            "SELECT key, value FROM meta WHERE key IN ('revision', 'modified_at')"
+        ).fetchall())
+        modified_at = values.get('modified_at')
+        return int(values.get('revision', 0)), float(modified_at) if modified_at else None
+
+    def delete_draft(self, draft_id):
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT seq FROM drafts WHERE id = ?", (draft_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM drafts WHERE seq = ?", (row[0],))
+            conn.execute("DELETE FROM drafts_fts WHERE rowid = ?", (row[0],))
+            self._touch(conn, time.time())
+        return True
+
+    def search_drafts(self, query, limit=20, draft_type=None, created_from=None, created_to=None):
+        match = build_match_query(query)
+        if not match:
+            return [], False
+        conditions = ""
+        params = [match]
+        if draft_type:
+            conditions += " AND d.type = ?"
+            params.append(draft_type)
+        if created_from:
+            conditions += " AND d.created_at >= ?"
+            params.append(created_from)
+        if created_to:
+            conditions += " AND d.created_at <= ?"
+            params.append(created_to)
+        # 对所有匹配结果计算 bm25 的开销与匹配数成正比（常见词在 10 万条草稿中约 200ms），
+        # 因此只对最新的 SEARCH_CANDIDATES 条匹配结果排序；匹配数较少时结果与全量排序相同，
+        # 超过时返回 truncated，由接口告知调用方（更早的草稿可能更相关但不在结果中）。
+        # bm25 中标题的权重高于正文，分数越小越相关。
+        matches = (
+            "SELECT drafts_fts.rowid AS seq, bm25(drafts_fts, 5.0, 1.0) AS rank "
+            "FROM drafts_fts JOIN drafts d ON d.seq = drafts_fts.rowid "
+            f"WHERE drafts_fts MATCH ?{conditions} "
+            "ORDER BY drafts_fts.rowid DESC LIMIT ?"
+        )
+        sql = f"SELECT d.data, c.rank FROM ({matches}) c JOIN drafts d ON d.seq = c.seq ORDER BY c.rank LIMIT ?"
+        conn = self._db.connect()
+        # 只按 rowid 判断是否有第 SEARCH_CANDIDATES + 1 条匹配，不计算 bm25，开销很小
+        truncated = conn.execute(
+            f"SELECT 1 FROM ({matches} OFFSET ?)", params + [1, self.SEARCH_CANDIDATES]
+        ).fetchone() is not None
+        matcher = highlight_pattern(query)
+        results = []
+        for data, rank in conn.execute(sql, params + [self.SEARCH_CANDIDATES, limit]).fetchall():
+            draft = json.loads(data)
+            results.append({
+                "id": draft.get('id'),
+                "type": draft.get('type'),
+                "title": draft.get('title'),
+                "createdAt": draft.get('createdAt'),
+                "snippet": make_snippet(draft.get('content'), matcher),
+                "score": round(-rank, 4),
+            })
+        return results, truncated
+
+    def migrate_from_json(self, json_path):
+        """
+        从旧版 drafts.json 导入草稿（只执行一次）。
+        旧文件按新到旧排列，导入后保持相同顺序；原文件保留不动。
+        模型生成的草稿（<br> 与 Markdown 混合）转换为 Markdown 原文保存。
+        返回导入的草稿数量。
+        """
+        if not os.path.exists(json_path) or os.path.getsize(json_path) == 0:
+            return 0
+        with self._db.transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_from_json'"
+            ).fetchone()
+            if done:
+                return 0
+            with open(json_path, 'r', encoding='utf-8') as f:
+                try:
+                    drafts = json.load(f)
+                except json.JSONDecodeError:
+                    drafts = []
+            count = 0
+            now = time.time()
+            for draft in reversed(drafts):
+                draft = legacy_to_markdown({**draft, 'id': draft.get('id') or str(uuid4())})
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO drafts (id, updated_at, type, title, created_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (draft['id'], now, *self._row_values(draft))
+                )
+                if cursor.rowcount:
+                    self._index(conn, cursor.lastrowid, draft, replace=False)
+                count += cursor.rowcount
+            if count:
+                self._touch(conn, now)
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (os.path.abspath(json_path),)
+            )
+        return count
+
+
+class TimedDraftStore(DraftStore):
+    """包装任意草稿存储，把每个操作的耗时记录到 draft_store_operation_duration_seconds"""
+
+    def __init__(self, store, backend):
+        self.store = store
+        self.backend = backend
+
+    def _timed(self, operation, *args, **kwargs):
+        with metrics.DRAFT_STORE_SECONDS.time(backend=self.backend, operation=operation):
+            return getattr(self.store, operation)(*args, **kwargs)
+
+    def query_drafts(self, *args, **kwargs):
+        return self._timed('query_drafts', *args, **kwargs)
+
+    def get_draft(self, draft_id):
+        return self._timed('get_draft', draft_id)
+
+    def create_draft(self, draft):
+        return self._timed('create_draft', draft)
+
+    def update_draft(self, draft_id, fields, expected_version=None):
+        return self._timed('update_draft', draft_id, fields, expected_version)
+
+    def patch_draft(self, draft_id, apply, expected_version=None):
+        return self._timed('patch_draft', draft_id, apply, expected_version)
+
+    def draft_version(self, draft_id):
+        return self._timed('draft_version', draft_id)
+
+    def draft_revision(self, draft_id):
+        return self._timed('draft_revision', draft_id)
+
+    def store_revision(self):
+        return self._timed('store_revision')
+
+    def delete_draft(self, draft_id):
+        return self._timed('delete_draft', draft_id)
+
+    def search_drafts(self, *args, **kwargs):
+        return self._timed('search_drafts', *args, **kwargs)
+
+    def migrate_from_json(self, json_path):
+        return self._timed('migrate_from_json', json_path)
+
+
+# 可用的存储后端
+DRAFT_STORES = {
+    "sqlite": SQLiteDraftStore,
+}
+
+
+def open_draft_store(backend, path):
+    """按名称创建草稿存储后端（操作耗时计入指标）"""
+    if backend not in DRAFT_STORES:
+        raise ValueError(f"未知的草稿存储后端：{backend}")
+    return TimedDraftStore(DRAFT_STORES[backend](path), backend)
+
+
+if __name__ == "__main__":
+    # 手动迁移：python draft_store.py drafts.json drafts.db
+    import sys
+    source = sys.argv[1] if len(sys.argv) > 1 else 'drafts.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'drafts.db'
+    imported = SQLiteDraftStore(target).migrate_from_json(source)
+    print(f"已从 {source} 导入 {imported} 条草稿到 {target}")
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import socket
+import asyncio
+from uuid import uuid4
+
+import metrics
+from sqlite_db import SQLiteDatabase
+
+
+class JobQueue:
+    """
+    持久化的任务队列（SQLite，WAL 模式）。
+    提交的任务在重启后仍然保留；认领任务在 BEGIN IMMEDIATE 事务中完成，
+    多个进程共用同一个数据库时每个任务也只会被一个 worker 认领。
+    认领时设置租约（lease），执行期间由 worker 定期续约；worker 异常退出后租约到期的任务会重新排队。
+    完成、失败和放回队列都只对认领该任务的 worker 生效，租约失效后迟到的结果会被丢弃。
+    已完成和失败的任务保留 retention 秒后删除（为 0 时不删除）。
+    """
+
+    # 清理过期任务的最小间隔（秒）；requeue_expired 每次轮询都会调用，不需要每次都清理
+    PRUNE_INTERVAL = 600.0
+
+    def __init__(self, db_path, lease=300.0, max_attempts=3, retention=7 * 86400):
+        self.db_path = db_path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._pruned_at = 0.0
+        self._db = SQLiteDatabase(db_path)
+        with self._db.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "kind TEXT NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, "
+                "started_at REAL, "
+                "finished_at REAL, "
+                "lease_until REAL, "
+                "worker TEXT, "
+                "result TEXT, "
+                "error TEXT)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)"
+            )
+
+    @staticmethod
+    def _to_dict(row):
+        job_id, kind, status, attempts, created_at, started_at, finished_at, result, error = row
+        job = {
+            "jobId": job_id,
+            "kind": kind,
+            "status": status,
+            "attempts": attempts,
+            "createdAt": created_at,
+            "startedAt": started_at,
+            "finishedAt": finished_at,
+        }
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = json.loads(error)
+        return job
+
+    def submit(self, kind, payload):
+        """提交任务，返回任务信息（status 为 queued）"""
+        job_id = str(uuid4())
+        self._db.connect().execute(
+            "INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), time.time())
+        )
+        metrics.JOBS.inc(kind=kind, status="queued")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """返回任务信息，不存在时返回 None"""
+        row = self._db.connect().execute(
+            "SELECT id, kind, status, attempts, created_at, started_at, finished_at, result, error "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def position(self, job_id):
+        """排队中的任务前面还有多少个任务；不在排队时返回 None"""
+        conn = self._db.connect()
+        row = conn.execute(
+            "SELECT created_at FROM jobs WHERE id = ? AND status = 'queued'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (row[0],)
+        ).fetchone()[0]
+
+    def claim(self, worker):
+        """
+        认领最早的排队任务，返回 (任务 id, 类型, 参数)；没有任务时返回 None。
+        超过最大尝试次数的任务（多次在执行中途丢失）直接标记为失败。
+        """
+        now = time.time()
+        with self._db.transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id, kind, payload, attempts, created_at FROM jobs "
+                    "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                job_id, kind, payload, attempts, created_at = row
+                if attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                        (now, json.dumps({"code": "abandoned", "message": "任务多次执行中断，已放弃"}), job_id)
+                    )
+                    metrics.JOBS.inc(kind=kind, status="failed")
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                    "lease_until = ?, worker = ? WHERE id = ?",
+                    (now, now + self.lease, worker, job_id)
+                )
+                break
+        metrics.JOB_WAIT_SECONDS.observe(now - created_at, kind=kind)
+        return job_id, kind, json.loads(payload)
+
+    def _finish(self, job_id, worker, status, result=None, error=None):
+        conn = self._db.connect()
+        now = time.time()
+        row = conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL, result = ?, error = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ? RETURNING kind, started_at",
+            (
+                status, now,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                json.dumps(error, ensure_ascii=False) if error is not None else None,
+                job_id, worker,
+            )
+        ).fetchone()
+        if row:
+            metrics.JOBS.inc(kind=row[0], status=status)
+            metrics.JOB_RUN_SECONDS.observe(now - row[1], kind=row[0], status=status)
+        return row is not None
+
+    def complete(self, job_id, worker, result):
+        return self._finish(job_id, worker, "done", result=result)
+
+    def fail(self, job_id, worker, error):
+        return self._finish(job_id, worker, "failed", error=error)
+
+    def renew(self, job_id, worker):
+        """延长租约；任务已不属于该 worker（租约过期后被重新排队或认领）时返回 False"""
+        cursor = self._db.connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + self.lease, job_id, worker)
+        )
+        return cursor.rowcount > 0
+
+    def release(self, job_id, worker):
+        """把执行中的任务放回队列（进程正常关闭时调用），不计入尝试次数"""
+        self._db.connect().execute(
+            "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), lease_until = NULL, "
+            "worker = NULL WHERE id = ? AND status = 'running' AND worker = ?", (job_id, worker)
+        )
+
+    def requeue_expired(self):
+        """租约到期仍在执行的任务（worker 已退出）重新排队，返回数量；顺带清理过期的已结束任务"""
+        now = time.time()
+        cursor = self._db.connect().execute(
+            "UPDATE jobs SET status = 'queued', lease_until = NULL, worker = NULL "
+            "WHERE status = 'running' AND lease_until < ?", (now,)
+        )
+        if now - self._pruned_at >= self.PRUNE_INTERVAL:
+            self._pruned_at = now
+            self.prune(now)
+        return cursor.rowcount
+
+    def prune(self, now=None):
+        """删除结束超过 retention 秒的 done / failed 任务，返回删除的数量"""
+        now = time.time() if now is None else now
+        if not self.retention:
+            return 0
+        cursor = self._db.connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (now - self.retention,)
+        )
+        if cursor.rowcount:
+            print(f"已清理 {cursor.rowcount} 个过期任务")
+        return cursor.rowcount
+
+    def stats(self):
+        """队列深度、最早排队任务的等待时间，以及最近 100 个任务的平均等待和执行时间"""
+        conn = self._db.connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        recent = conn.execute(
+            "SELECT AVG(started_at - created_at), AVG(finished_at - started_at) FROM ("
+            "SELECT created_at, started_at, finished_at FROM jobs WHERE finished_at IS NOT NULL "
+            "AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT 100)"
+        ).fetchone()
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldestQueuedSeconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "avgWaitSeconds": round(recent[0] or 0.0, 3),
+            "avgRunSeconds": round(recent[1] or 0.0, 3),
+        }
+
+
+class JobWorkerPool:
+    """
+    在事件循环中运行 concurrency 个 worker，从 JobQueue 认领任务并调用 handlers[kind](payload)。
+    handler 返回的 dict 作为任务结果保存；抛出的异常转换为错误信息。
+    本进程提交任务时立即唤醒 worker，其他进程提交的任务按 poll_interval 轮询发现。
+    任务执行期间每 lease / 3 秒续约一次：准入控制排队和退避重试可能比租约更长，
+    不续约的话任务会在执行中被其他 worker 重新认领，重复调用 LLM 并生成重复的草稿。
+    """
+
+    def __init__(self, queue, handlers, concurrency=4, poll_interval=1.0, error_to_dict=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.error_to_dict = error_to_dict or (lambda e: {"code": "internal_error", "message": str(e)})
+        # 租约按 worker 名称区分归属，同一进程中的多个 pool 也不能重名
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        self._wakeup = None
+        self._loop = None
+        self._tasks = []
+        self._running = {}  # worker 名称 -> 任务 id
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.queue.requeue_expired()
+        self._tasks = [
+            asyncio.create_task(self._work(f"{self.worker_prefix}:{n}"))
+            for n in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """停止 worker，执行到一半的任务放回队列，由下次启动（或其他进程）继续执行"""
+        # worker 被取消时会清理 _running，先记下执行中的任务
+        running = list(self._running.items())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for name, job_id in running:
+            self.queue.release(job_id, name)
+        self._tasks = []
+        self._running = {}
+
+    def notify(self):
+        """唤醒空闲的 worker；asyncio.Event 不是线程安全的，在其他线程中调用时交给事件循环执行"""
+        if self._wakeup is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _work(self, name):
+        while True:
+            claimed = await asyncio.to_thread(self.queue.claim, name)
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self.queue.requeue_expired)
+                continue
+            job_id, kind, payload = claimed
+            self._running[name] = job_id
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, name))
+            try:
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    raise ValueError(f"未知的任务类型：{kind}")
+                try:
+                    result = await handler(payload)
+                finally:
+                    # 先停止续约再写结果，否则续约可能在任务完成后执行并误报租约失效
+                    heartbeat.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"任务 {job_id} 执行失败：{e}")
+                await asyncio.to_thread(self.queue.fail, job_id, name, self.error_to_dict(e))
+            else:
+                await asyncio.to_thread(self.queue.complete, job_id, name, result)
+            finally:
+                heartbeat.cancel()
+                self._running.pop(name, None)
+
+    async def _heartbeat(self, job_id, name):
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            try:
+                renewed = await asyncio.to_thread(self.queue.renew, job_id, name)
+            except Exception as e:
+                print(f"任务 {job_id} 续约失败：{e}")
+                continue
+            if not renewed:
+                print(f"任务 {job_id} 的租约已失效，执行结果将被丢弃")
+                return
@@ -0,0 +1,300 @@
+import os
+import math
+import time
+import random
+import asyncio
+import hashlib
+
+
+class LLMResponse:
+    """一次生成的结果：文本以及（如果后端提供）token 用量"""
+
+    def __init__(self, text, input_tokens=None, output_tokens=None, cached_tokens=None):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+
+
+class LLMProvider:
+    """
+    LLM 后端接口。core.py 只通过这两个方法调用模型，
+    具体实现由 LLM_PROVIDER 环境变量选择。
+    context 为多次调用共用的静态前缀（指令和模板），后端应尽量缓存，
+    每次请求只发送变化的 prompt。
+    """
+
+    name = "base"
+
+    async def generate(self, prompt, model, context=None):
+        """生成完整文本，返回 LLMResponse"""
+        raise NotImplementedError
+
+    async def generate_stream(self, prompt, model, context=None):
+        """返回逐块产出文本（str）的异步迭代器"""
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini（google-genai SDK 的异步客户端）。
+    context 通过 context caching API 注册为缓存内容，同一 context 在 TTL 内只上传一次；
+    无法显式缓存时改为作为 system_instruction 发送。
+    显式缓存有最小 token 数（2.5 Flash 为 1024，Pro 为 4096，可用 GEMINI_CACHE_MIN_TOKENS 覆盖），
+    低于最小值的 context 用 count_tokens 确认一次后不再尝试创建缓存。
+    """
+
+    name = "gemini"
+
+    # 创建缓存失败后，多久之后再尝试（秒）
+    CACHE_RETRY_AFTER = 600
+    # 各模型显式缓存的最小 token 数，按模型名中的关键字匹配
+    CACHE_MIN_TOKENS = {"pro": 4096}
+    DEFAULT_CACHE_MIN_TOKENS = 1024
+
+    def __init__(self, api_key=None, cache_ttl=3600, cache_min_tokens=None):
+        from google import genai
+
+        api_key = api_key or os.getenv('GOOGLE_API_KEY')
+        if not api_key:
+            raise ValueError("请在 .env 文件中设置 GOOGLE_API_KEY")
+        self.client = genai.Client(api_key=api_key)
+        self.cache_ttl = cache_ttl
+        self.cache_min_tokens = cache_min_tokens
+        self._caches = {}  # (model, context 摘要) -> (缓存名称或 None, 过期时间)
+        self._cache_locks = {}
+
+    async def _cached_content(self, context, model):
+        """返回 context 对应的缓存名称，首次使用时创建；无法缓存时返回 None"""
+        from google.genai import types
+
+        key = (model, hashlib.sha256(context.encode('utf-8')).hexdigest())
+        entry = self._caches.get(key)
+        if entry and entry[1] > time.time():
+            return entry[0]
+        lock = self._cache_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._caches.get(key)
+            if entry and entry[1] > time.time():
+                return entry[0]
+            if not await self._cacheable(context, model):
+                # context 的长度不会变化，以后也不再尝试
+                self._caches[key] = (None, math.inf)
+                return None
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=context,
+                        ttl=f"{self.cache_ttl}s",
+                        display_name=f"tum-assistants-{key[1][:12]}",
+                    )
+                )
+            except Exception as e:
+                print(f"无法创建 Gemini 上下文缓存，改为直接发送：{e}")
+                self._caches[key] = (None, time.time() + self.CACHE_RETRY_AFTER)
+                return None
+            # 提前一分钟视为过期，避免使用即将失效的缓存
+            self._caches[key] = (cache.name, time.time() + self.cache_ttl - 60)
+            return cache.name
+
+    @staticmethod
+    def _is_stale_cache(error):
+        """
+        缓存已在服务端过期、被删除或无权访问时返回 True。
+        其他 4xx（尤其是 429 限流）原样抛出，由 core 的退避重试和熔断处理，
+        不能丢掉缓存后立即再请求一次。
+        """
+        if error.code in (403, 404):
+            return True
+        return error.code == 400 and "cache" in (error.message or "").lower()
+
+    def _min_cache_tokens(self, model):
+        if self.cache_min_tokens:
+            return self.cache_min_tokens
+        for keyword, minimum in self.CACHE_MIN_TOKENS.items():
+            if keyword in model:
+                return minimum
+        return self.DEFAULT_CACHE_MIN_TOKENS
+
+    async def _cacheable(self, context, model):
+        """context 是否达到显式缓存的最小 token 数；无法计数时按可以缓存处理"""
+        minimum = self._min_cache_tokens(model)
+        # 每个 token 至少对应一个字符，更短的内容不需要请求 count_tokens
+        if len(context) < minimum:
+            return False
+        try:
+            result = await self.client.aio.models.count_tokens(model=model, contents=context)
+        except Exception as e:
+            print(f"无法统计上下文 token 数：{e}")
+            return True
+        if result.total_tokens is None or result.total_tokens >= minimum:
+            return True
+        print(f"上下文只有 {result.total_tokens} 个 token，低于显式缓存的最小值 {minimum}，直接发送")
+        return False
+
+    def _should_retry_uncached(self, config, error):
+        """使用了上下文缓存且错误表明缓存已失效时，应丢弃缓存后不带缓存重试一次"""
+        return bool(config and config.cached_content) and self._is_stale_cache(error)
+
+    def _forget(self, context, model):
+        key = (model, hashlib.sha256(context.encode('utf-8')).hexdigest())
+        self._caches.pop(key, None)
+
+    async def _config(self, context, model, use_cache=True):
+        from google.genai import types
+
+        if not context:
+            return None
+        name = await self._cached_content(context, model) if use_cache else None
+        if name:
+            return types.GenerateContentConfig(cached_content=name)
+        return types.GenerateContentConfig(system_instruction=context)
+
+    @staticmethod
+    def _to_response(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResponse(
+            response.text,
+            input_tokens=getattr(usage, 'prompt_token_count', None),
+            output_tokens=getattr(usage, 'candidates_token_count', None),
+            cached_tokens=getattr(usage, 'cached_content_token_count', None),
+        )
+
+    async def generate(self, prompt, model, context=None):
+        from google.genai import errors
+
+        config = await self._config(context, model)
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=config
+            )
+        except errors.ClientError as e:
+            if not self._should_retry_uncached(config, e):
+                raise
+            # 缓存可能已在服务端过期或被删除：丢弃后不带缓存重试一次
+            self._forget(context, model)
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=await self._config(context, model, use_cache=False)
+            )
+        return self._to_response(response)
+
+    async def generate_stream(self, prompt, model, context=None):
+        from google.genai import errors
+
+        config = await self._config(context, model)
+        started = False
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=model,
+                contents=prompt,
+                config=config
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+            return
+        except errors.ClientError as e:
+            # 已经输出过内容时不能重来，否则客户端会收到重复的文本
+            if started or not self._should_retry_uncached(config, e):
+                raise
+            self._forget(context, model)
+        stream = await self.client.aio.models.generate_content_stream(
+            model=model,
+            contents=prompt,
+            config=await self._config(context, model, use_cache=False)
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
+
+class StubProvider(LLMProvider):
+    """
+    本地桩实现，用于压测和离线开发：不访问网络、不需要 API key。
+    输出由提示词决定（相同提示词得到相同结果），延迟和输出长度可配置，
+    也可以按比例模拟上游失败。
+    """
+
+    name = "stub"
+
+    WORDS = (
+        "Liebe Studierende bitte beachten Sie die folgenden Informationen "
+        "Dear students please note the following information regarding the course"
+    ).split()
+
+    def __init__(self, latency=0.5, output_chars=1500, chunks=10, error_rate=0.0):
+        self.latency = latency
+        self.output_chars = output_chars
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        # 模拟上下文缓存：见过且达到最小长度的 context 之后按缓存 token 计
+        self._contexts = set()
+
+    def _render(self, prompt):
+        seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16], 16)
+        rng = random.Random(seed)
+        words = []
+        length = 0
+        while length < self.output_chars:
+            word = rng.choice(self.WORDS)
+            words.append(word)
+            length += len(word) + 1
+            if rng.random() < 0.08:
+                words.append("\n")
+        return " ".join(words)[:self.output_chars]
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError("stub provider: simulated upstream failure")
+
+    async def generate(self, prompt, model, context=None):
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        text = self._render((context or "") + prompt)
+        cached = 0
+        if context:
+            cacheable = len(context) // 4 >= GeminiProvider.DEFAULT_CACHE_MIN_TOKENS
+            cached = len(context) // 4 if cacheable and context in self._contexts else 0
+            self._contexts.add(context)
+        return LLMResponse(
+            text,
+            input_tokens=(len(context or "") + len(prompt)) // 4,
+            output_tokens=len(text) // 4,
+            cached_tokens=cached,
+        )
+
+    async def generate_stream(self, prompt, model, context=None):
+        self._maybe_fail()
+        text = self._render((context or "") + prompt)
+        size = -(-len(text) // self.chunks)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield text[start:start + size]
+
+
+def create_provider(name=None):
+    """
+    按名称创建 LLM 后端：gemini（默认）或 stub。
+    gemini 的上下文缓存有效期来自 GEMINI_CONTEXT_CACHE_TTL（秒），最小 token 数来自 GEMINI_CACHE_MIN_TOKENS。
+    stub 的参数来自 STUB_LATENCY（秒）、STUB_OUTPUT_CHARS、STUB_CHUNKS、STUB_ERROR_RATE。
+    """
+    name = (name or os.getenv('LLM_PROVIDER', 'gemini')).lower()
+    if name == "gemini":
+        return GeminiProvider(
+            cache_ttl=int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', '3600')),
+            cache_min_tokens=int(os.getenv('GEMINI_CACHE_MIN_TOKENS', '0')) or None,
+        )
+    if name == "stub":
+        return StubProvider(
+            latency=float(os.getenv('STUB_LATENCY', '0.5')),
+            output_chars=int(os.getenv('STUB_OUTPUT_CHARS', '1500')),
+            chunks=int(os.getenv('STUB_CHUNKS', '10')),
+            error_rate=float(os.getenv('STUB_ERROR_RATE', '0')),
+        )
+    raise ValueError(f"未知的 LLM 后端：{name}")
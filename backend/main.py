@@ -1,22 +1,77 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Query, Response, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, Literal
+from typing import Any, Optional, Literal, List
 from core import (
-    process_course_registration,
-    process_event_notice,
-    process_schedule_request,
-    process_schedule_announcement,
-    process_schedule_change,
+    prepare_course_registration,
+    prepare_event_notice,
+    prepare_schedule_request,
+    prepare_schedule_announcement,
+    prepare_schedule_change,
+    run_generation,
+    stream_generation,
+    generate_text_stream,
+    build_free_prompt,
+    build_gemini_edit_prompt,
+    locate_section,
     process_student_reply,
     process_holiday_notice,
-    process_free_prompt
+    process_free_prompt,
+    process_gemini_edit,
+    response_cache,
+    templates,
+    TemplateValidationError,
+    LLMError,
+    circuit_breaker,
+    admission_controller,
+    llm_priority,
+    single_flight,
+    token_usage_stats,
+    get_provider,
+    LLM_TIMEOUT,
+    LLM_MAX_RETRIES
 )
+from draft_store import (
+    open_draft_store,
+    apply_json_patch,
+    apply_merge_patch,
+    PatchError,
+    PatchTestFailed,
+    VersionConflict,
+)
+from job_queue import JobQueue, JobWorkerPool
+from markup import render_markdown, html_to_markdown, MarkdownStream, RenderCache
+from compression import CompressionMiddleware, base_etag
+from metrics import HTTP_REQUEST_SECONDS, GENERATION_STAGE_SECONDS, JOB_QUEUE_DEPTH, render as render_metrics
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 import os
 import json
-from uuid import uuid4
+import time
+import asyncio
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动时完成所有初始化（导入 main/core 时不做任何工作）：
+    加载模板并开始监视模板目录、创建 LLM 后端、打开草稿存储、启动任务队列的 worker。
+    """
+    templates.reload()
+    # 模板目录中新增或修改的模板无需重启即可生效
+    templates.start_watching()
+    get_provider()
+    get_draft_store()
+    pool = get_job_pool()
+    pool.start()
+    try:
+        yield
+    finally:
+        # 执行到一半的任务放回队列，下次启动时继续执行
+        await pool.stop()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 配置CORS
 app.add_middleware(
@@ -25,8 +80,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Search-Truncated", "ETag", "Last-Modified"],
 )
 
+# 压缩较大的响应（草稿列表、正文 HTML）；流式响应不压缩
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv('COMPRESS_MIN_SIZE', '1024')))
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """
+    记录每个请求的处理耗时（按路由模板而不是实际路径分组，避免草稿 id 造成标签爆炸）。
+    流式响应只计到响应头发出为止。
+    """
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status,
+        )
+
 # 定义支持的模板类型
 class TemplateRequest(BaseModel):
     templateType: Literal[
@@ -56,22 +136,84 @@ class TemplateRequest(BaseModel):
     replyDeadline: Optional[str] = None
     timeOptions: Optional[str] = None
     name: Optional[str] = None
+    # 为 True 时跳过响应缓存，强制重新生成
+    bypassCache: bool = False
+    # 德语和英语部分分两次并发生成（未指定时由 BILINGUAL_SPLIT 决定）
+    splitLanguages: Optional[bool] = None
+    # 只重新生成一种语言，另一种语言使用缓存结果（隐含 splitLanguages）
+    regenerateLanguage: Optional[Literal["de", "en"]] = None
 
-# 草稿存储文件
-DRAFTS_FILE = './drafts.json'
+# 草稿存储：默认使用 backend/drafts.db（SQLite），首次启动时自动导入旧的 drafts.json
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DRAFTS_FILE = os.path.join(BASE_DIR, 'drafts.json')
+DRAFTS_DB = os.getenv('DRAFTS_DB', os.path.join(BASE_DIR, 'drafts.db'))
 
-def load_drafts():
-    if not os.path.exists(DRAFTS_FILE) or os.path.getsize(DRAFTS_FILE) == 0:
-        return []
-    with open(DRAFTS_FILE, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+_draft_store = None
+
+def get_draft_store():
+    """返回草稿存储，首次调用时打开并导入旧的 drafts.json"""
+    global _draft_store
+    if _draft_store is None:
+        store = open_draft_store(os.getenv('DRAFT_STORE', 'sqlite'), DRAFTS_DB)
+        store.migrate_from_json(DRAFTS_FILE)
+        _draft_store = store
+    return _draft_store
+
+# 异步任务队列：默认使用 backend/jobs.db，排队中的任务在重启后继续执行
+JOBS_DB = os.getenv('JOBS_DB', os.path.join(BASE_DIR, 'jobs.db'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# 已完成和失败的任务保留天数，0 表示不清理
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '7'))
+
+_job_queue = None
+_job_pool = None
+
+def get_job_queue():
+    """返回任务队列，首次调用时打开数据库"""
+    global _job_queue
+    if _job_queue is None:
+        # 执行期间 worker 每 lease / 3 秒续约，租约只决定 worker 异常退出后多久重新排队
+        _job_queue = JobQueue(
+            JOBS_DB, lease=LLM_TIMEOUT * (LLM_MAX_RETRIES + 1) + 30, max_attempts=JOB_MAX_ATTEMPTS,
+            retention=JOB_RETENTION_DAYS * 86400
+        )
+        JOB_QUEUE_DEPTH.collect = lambda: {
+            (status,): count for status, count in _job_queue.stats().items()
+            if status in ("queued", "running")
+        }
+    return _job_queue
+
+def get_job_pool():
+    """返回本进程的 worker 池（在 lifespan 中启动）"""
+    global _job_pool
+    if _job_pool is None:
+        _job_pool = JobWorkerPool(
+            get_job_queue(), JOB_HANDLERS, JOB_WORKERS, JOB_POLL_INTERVAL, error_to_dict=job_error
+        )
+    return _job_pool
 
-def save_drafts(drafts):
-    with open(DRAFTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(drafts, f, ensure_ascii=False, indent=2)
+# 以 Markdown 原文保存的草稿（contentFormat 为 markdown）在读取时渲染为 HTML，按草稿缓存渲染结果
+render_cache = RenderCache(int(os.getenv('RENDER_CACHE_SIZE', '1024')))
+
+def present_draft(draft):
+    """
+    返回给客户端的草稿：content 总是 HTML（与编辑器保存的格式一致），不暴露 contentFormat。
+    客户端把它原样提交回来时按 HTML 草稿保存。
+    """
+    if draft.get("contentFormat") != "markdown":
+        return draft
+    shown = {key: value for key, value in draft.items() if key != "contentFormat"}
+    if "content" in draft:
+        shown["content"] = render_cache.render(draft.get("id"), draft["content"] or "")
+    return shown
+
+@app.exception_handler(LLMError)
+async def llm_error_handler(request, exc: LLMError):
+    """Gemini 调用失败时返回结构化错误，而不是把错误文本混进生成内容"""
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after is not None else None
+    return JSONResponse(status_code=exc.status, content={"detail": exc.to_dict()}, headers=headers)
 
 class FreePromptRequest(BaseModel):
     prompt: str
@@ -87,28 +229,30 @@ class HolidayNoticeRequest(BaseModel):
     name: Optional[str] = None
 
 class GeminiEditRequest(BaseModel):
-    content: str
+    # 带 draftId 时可以省略 content，直接编辑已保存的草稿
+    content: Optional[str] = None
     instruction: str
+    # 指定草稿 id 时，编辑结果直接写回该草稿
+    draftId: Optional[str] = None
+    # 只改写德语（de）或英语（en）部分，其余内容原样保留
+    section: Optional[Literal["de", "en"]] = None
 
-@app.post("/api/generate")
-async def generate_document(request: TemplateRequest):
-    try:
-        note = request.additionalNote or ""
-        if note:
-            with open('./data/note.txt', 'w', encoding='utf-8') as f:
-                f.write(note)
-
-        t = request.templateType
+def prepare_template_request(request: TemplateRequest):
+    """把 TemplateRequest 转换为 core 中对应模板的生成计划"""
+    t = request.templateType
+    # 读取模板、替换字段和构造提示词的耗时
+    with GENERATION_STAGE_SECONDS.time(template_type=t, stage="prepare"):
 
         if t == "course_registration":
-            return {"content": process_course_registration(
+            return prepare_course_registration(
                 time_start=request.startDate,
                 time_end=request.endDate,
                 target_group=request.targetAudience,
-                name=request.name
-            )}
+                name=request.name,
+                note=request.additionalNote
+            )
         elif t == "event_notice":
-            return {"content": process_event_notice(
+            return prepare_event_notice(
                 event_name=request.courseName,
                 event_intro=request.additionalNote,
                 event_time=request.eventTime,
@@ -117,9 +261,9 @@ async def generate_document(request: TemplateRequest):
                 registration=request.registration,
                 language=request.language,
                 name=request.name
-            )}
+            )
         elif t == "schedule_request":
-            return {"content": process_schedule_request(
+            return prepare_schedule_request(
                 course_name=request.courseName,
                 course_code=request.courseCode,
                 semester=request.semester,
@@ -127,9 +271,9 @@ async def generate_document(request: TemplateRequest):
                 reply_deadline=request.replyDeadline,
                 name=request.name,
                 target_group=request.targetAudience
-            )}
+            )
         elif t == "schedule_announcement":
-            return {"content": process_schedule_announcement(
+            return prepare_schedule_announcement(
                 course_name=request.courseName,
                 course_code=request.courseCode,
                 instructor_name=request.instructorName,
@@ -138,9 +282,9 @@ async def generate_document(request: TemplateRequest):
                 weekly_location=request.weeklyLocation,
                 target_group=request.targetAudience,
                 name=request.name
-            )}
+            )
         elif t == "schedule_change":
-            return {"content": process_schedule_change(
+            return prepare_schedule_change(
                 course_name=request.courseName,
                 course_code=request.courseCode,
                 reason=request.reason,
@@ -150,89 +294,642 @@ async def generate_document(request: TemplateRequest):
                 new_location=request.newLocation,
                 target_group=request.targetAudience,
                 name=request.name
-            )}
-        else:
-            raise HTTPException(status_code=400, detail="Unknown template type")
+            )
+        raise HTTPException(status_code=400, detail="Unknown template type")
 
+@app.post("/api/generate")
+async def generate_document(request: TemplateRequest):
+    try:
+        plan = prepare_template_request(request)
+        result = await run_generation(plan, request.bypassCache, request.splitLanguages, request.regenerateLanguage)
+
+        # 生成失败时返回 None
+        return render_result(result, request.templateType) if result else {"content": None}
+
+    except (HTTPException, LLMError):
+        raise
+    except TemplateValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "missing": e.missing})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(data, event=None):
+    """编码一条 Server-Sent Event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def sse_response(chunks, on_done=None):
+    """
+    把 Markdown 文本块的异步迭代器包装为 SSE 响应：渲染出完整的行后发送 data 事件（HTML），
+    结束时发送 done 事件（含完整的 HTML），出错时发送 error 事件。
+    on_done(原文) 可返回需要附加到 done 事件中的字段，例如保存后的草稿 id；
+    它通常要写草稿库（SQLite 写锁可能需要等待），因此在线程中执行。
+    先等到第一块再发送响应头：准入控制拒绝、熔断等在输出之前的失败直接返回对应的状态码
+    （429 / 503 等，带 Retry-After），而不是 200 之后的 error 事件。
+    开始输出后的失败只能通过 error 事件通知，事件内容与 LLMError.to_dict() 相同，
+    可重试时包含 retryAfter（秒）。
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def events():
+        stream = MarkdownStream()
+        parts = []
+        try:
+            if first is not None:
+                delta = stream.feed(first)
+                if delta:
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+                async for chunk in chunks:
+                    delta = stream.feed(chunk)
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            delta = stream.close()
+            if delta:
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            extra = await asyncio.to_thread(on_done, stream.source) if on_done else None
+            yield sse_event({"content": "".join(parts), **(extra or {})}, event="done")
+        except LLMError as e:
+            print(f"\n流式生成发生错误：{str(e)}")
+            yield sse_event(e.to_dict(), event="error")
+        except Exception as e:
+            print(f"\n流式生成发生错误：{str(e)}")
+            yield sse_event({"code": "internal_error", "message": str(e)}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def render_result(result, template_type):
+    """把 run_generation 结果中的 Markdown 原文渲染为 HTML"""
+    with GENERATION_STAGE_SECONDS.time(template_type=template_type, stage="postprocess"):
+        return {**result, "content": render_markdown(result["content"])}
+
+def save_generated_draft(draft_type, title, content, source=None):
+    """把生成结果（Markdown 原文）保存为新草稿，读取时再渲染为 HTML"""
+    draft = get_draft_store().create_draft({
+        "type": draft_type,
+        "title": title,
+        "content": content,
+        "contentFormat": "markdown",
+        "createdAt": datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        "source": source or {},
+    })
+    return {"draftId": draft["id"]}
+
+@app.post("/api/generate/stream")
+async def generate_document_stream(request: TemplateRequest, save: bool = False):
+    """/api/generate 的流式版本（SSE）；save=true 时把最终结果保存为草稿"""
+    try:
+        plan = prepare_template_request(request)
+    except TemplateValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "missing": e.missing})
+    if plan is None:
+        raise HTTPException(status_code=500, detail="Template not found")
+    on_done = None
+    if save:
+        on_done = lambda content: save_generated_draft(
+            request.templateType, request.templateType, content,
+            request.model_dump(exclude_none=True)
+        )
+    return await sse_response(stream_generation(plan, request.bypassCache, request.splitLanguages, request.regenerateLanguage), on_done)
+
+class BatchGenerateRequest(BaseModel):
+    requests: List[TemplateRequest]
+    # 为 True 时每条成功的结果直接保存为草稿
+    saveDrafts: bool = False
+
+# 批量生成的并发数；速率由准入控制的 batch 优先级限制（BATCH_RATE_PER_MINUTE）
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+@app.post("/api/generate/batch")
+async def generate_batch(batch: BatchGenerateRequest):
+    """
+    批量生成通知。相同输入只生成一次，其余请求在限流下并发执行。
+    结果按完成顺序以 NDJSON 流式返回，每行包含 index（在请求列表中的位置）和 status（ok / error）。
+    """
+    # 按请求内容去重：key -> 请求列表中的位置
+    groups = {}
+    for index, request in enumerate(batch.requests):
+        key = json.dumps(request.model_dump(), sort_keys=True, ensure_ascii=False)
+        groups.setdefault(key, []).append(index)
+
+    concurrency = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_one(indices):
+        request = batch.requests[indices[0]]
+        # 批量生成在准入控制中排在交互式请求之后，并受 batch 优先级的速率限制
+        llm_priority.set("batch")
+        async with concurrency:
+            try:
+                plan = prepare_template_request(request)
+                result = None
+                if plan is not None:
+                    result = await run_generation(plan, request.bypassCache, request.splitLanguages, request.regenerateLanguage)
+                if result and result.get("content"):
+                    return indices, {"status": "ok", **result}
+                return indices, {"status": "error", "message": "generation failed"}
+            except TemplateValidationError as e:
+                return indices, {"status": "error", "message": str(e), "missing": e.missing}
+            except LLMError as e:
+                return indices, {"status": "error", **e.to_dict()}
+            except Exception as e:
+                return indices, {"status": "error", "message": str(e)}
+
+    async def lines():
+        tasks = [asyncio.create_task(run_one(indices)) for indices in groups.values()]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indices, item = await finished
+                for index in indices:
+                    line = {"index": index, **item}
+                    if item["status"] == "ok":
+                        line["content"] = render_markdown(item["content"])
+                    if batch.saveDrafts and item["status"] == "ok":
+                        request = batch.requests[index]
+                        line.update(await asyncio.to_thread(
+                            save_generated_draft, request.templateType, request.templateType, item["content"],
+                            request.model_dump(exclude_none=True)
+                        ))
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端提前断开时取消尚未完成的生成
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/api/student_reply")
 async def student_reply_api(req: StudentReplyRequest):
     content = process_student_reply(student_name=req.student_name, name=req.name)
-    return {"content": content}
+    return {"content": render_markdown(content)}
 
 @app.post("/api/holiday_notice")
 async def holiday_notice_api(req: HolidayNoticeRequest):
     content = process_holiday_notice(holiday_name=req.holiday_name, holiday_date=req.holiday_date, name=req.name)
-    return {"content": content}
+    return {"content": render_markdown(content)}
 
 @app.post("/api/free_prompt")
 async def free_prompt_api(req: FreePromptRequest):
-    content = process_free_prompt(prompt=req.prompt, tone=req.tone)
-    return {"content": content}
+    content = await process_free_prompt(prompt=req.prompt, tone=req.tone)
+    return {"content": render_markdown(content)}
 
+@app.post("/api/free_prompt/stream")
+async def free_prompt_stream_api(req: FreePromptRequest, save: bool = False):
+    """/api/free_prompt 的流式版本（SSE）"""
+    if not req.prompt:
+        raise HTTPException(status_code=422, detail="prompt is required")
+
+    async def chunks():
+        async for chunk in generate_text_stream(build_free_prompt(req.prompt, req.tone)):
+            yield chunk
+
+    on_done = None
+    if save:
+        on_done = lambda content: save_generated_draft(
+            "freeTextGeneration", req.prompt[:50], content, req.model_dump(exclude_none=True)
+        )
+    return await sse_response(chunks(), on_done)
+
+# 草稿接口使用同步函数，由 FastAPI 放到线程池执行，不阻塞事件循环
 @app.get("/api/drafts")
-async def get_drafts():
-    return load_drafts()
+def get_drafts(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    type: Optional[str] = None,
+    createdFrom: Optional[str] = None,
+    createdTo: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    草稿列表。不带参数时返回全部草稿（与旧接口一致）。
+    limit/cursor 用于分页，下一页游标通过 X-Next-Cursor 响应头返回；
+    fields=title,type,createdAt 只返回指定字段，列表视图无需下载正文。
+    ETag 为草稿库的修订号：自上次请求以来没有任何草稿变化时返回 304，不再查询和渲染。
+    """
+    store = get_draft_store()
+    # 先取修订号再查询：期间有修改时 ETag 只会偏旧，下次请求重新获取，不会把新内容当成旧版本
+    revision, modified_at = store.store_revision()
+    validators = {"ETag": f'"r{revision}"', **cache_headers(modified_at)}
+    if not_modified(request, validators["ETag"], modified_at):
+        return Response(status_code=304, headers=validators)
+    names = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if names and "content" in names:
+        # 需要知道正文的格式才能渲染
+        names.append("contentFormat")
+    try:
+        drafts, next_cursor = store.query_drafts(
+            limit=limit,
+            cursor=cursor,
+            draft_type=type,
+            created_from=createdFrom,
+            created_to=createdTo,
+            fields=names,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.headers.update(validators)
+    return [present_draft(draft) for draft in drafts]
+
+@app.get("/api/drafts/search")
+def search_drafts(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    type: Optional[str] = None,
+    createdFrom: Optional[str] = None,
+    createdTo: Optional[str] = None,
+):
+    """
+    按标题和正文全文搜索草稿，结果按相关度排序。
+    忽略 HTML 标签和大小写，ä/ö/ü/ß 与 a/o/u/ss 的写法互相匹配，每个词按前缀匹配。
+    匹配的草稿过多时只在最新的一部分中排序，此时响应头带 X-Search-Truncated: true，
+    可以加上更具体的关键词或类型、日期条件缩小范围。
+    """
+    results, truncated = get_draft_store().search_drafts(
+        q, limit=limit, draft_type=type, created_from=createdFrom, created_to=createdTo
+    )
+    if truncated:
+        response.headers["X-Search-Truncated"] = "true"
+    return results
 
 @app.post("/api/drafts")
-async def create_draft(draft: dict = Body(...)):
-    drafts = load_drafts()
-    draft['id'] = str(uuid4())
-    drafts.insert(0, draft)
-    save_drafts(drafts)
-    return draft
+def create_draft(draft: dict = Body(...)):
+    return present_draft(get_draft_store().create_draft(draft))
+
+def draft_etag(version):
+    """草稿版本号作为 ETag，客户端修改时通过 If-Match 带回"""
+    return f'"{version}"'
+
+def cache_headers(modified_at):
+    """条件请求用的公共响应头：浏览器可以缓存，但每次使用前都要重新验证"""
+    headers = {"Cache-Control": "no-cache"}
+    if modified_at is not None:
+        headers["Last-Modified"] = formatdate(modified_at, usegmt=True)
+    return headers
+
+def not_modified(request: Request, etag, modified_at):
+    """
+    客户端缓存是否仍然有效：有 If-None-Match 时只比较 ETag（忽略压缩后缀和 W/ 前缀），
+    否则比较 If-Modified-Since 与最后修改时间（精确到秒）。
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(base_etag(tag.removeprefix("W/")) == etag for tag in tags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified_at is not None:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_if_match(if_match):
+    """把 If-Match 头转换为期望的版本号；未提供或为 * 时不检查版本"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = base_etag(if_match)
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(status_code=412, detail="Invalid If-Match version")
+    return int(value)
+
+def save_draft_changes(draft_id, apply, if_match, response):
+    """
+    在版本检查下修改草稿，返回新草稿并设置新的 ETag。
+    apply 作用于客户端看到的草稿（正文为 HTML）；正文没有改动时仍保存原来的 Markdown 原文。
+    """
+    def apply_shown(current):
+        shown = present_draft(current)
+        updated = apply(shown)
+        if current.get("contentFormat") == "markdown" and updated.get("content") == shown.get("content"):
+            updated = {**updated, "content": current.get("content"), "contentFormat": "markdown"}
+        return updated
+
+    try:
+        result = get_draft_store().patch_draft(draft_id, apply_shown, parse_if_match(if_match))
+    except VersionConflict as e:
+        raise HTTPException(
+            status_code=412,
+            detail={"message": str(e), "currentVersion": e.current_version},
+            headers={"ETag": draft_etag(e.current_version)},
+        )
+    except PatchTestFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Draft not found")
+    draft, version = result
+    response.headers["ETag"] = draft_etag(version)
+    return present_draft(draft)
 
 @app.get("/api/drafts/{draft_id}")
-async def get_draft(draft_id: str):
-    drafts = load_drafts()
-    for d in drafts:
-        if d['id'] == draft_id:
-            return d
-    raise HTTPException(status_code=404, detail="Draft not found")
+def get_draft(draft_id: str, request: Request, response: Response):
+    """
+    读取单个草稿，ETag 为版本号，Last-Modified 为最后修改时间。
+    带 If-None-Match / If-Modified-Since 且草稿未变化时返回 304，不读取正文也不渲染。
+    """
+    store = get_draft_store()
+    # 先取版本号再读正文，与 get_drafts 相同，ETag 不会比正文新
+    revision = store.draft_revision(draft_id)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Draft not found")
+    version, updated_at = revision
+    validators = {"ETag": draft_etag(version), **cache_headers(updated_at)}
+    if not_modified(request, validators["ETag"], updated_at):
+        return Response(status_code=304, headers=validators)
+    draft = store.get_draft(draft_id)
+    if draft is None:
+        raise HTTPException(status_code=404, detail="Draft not found")
+    response.headers.update(validators)
+    return present_draft(draft)
 
 @app.put("/api/drafts/{draft_id}")
-async def update_draft(draft_id: str, draft: dict = Body(...)):
-    drafts = load_drafts()
-    for i, d in enumerate(drafts):
-        if d['id'] == draft_id:
-            drafts[i] = {**d, **draft, 'id': draft_id}
-            save_drafts(drafts)
-            return drafts[i]
-    raise HTTPException(status_code=404, detail="Draft not found")
+def update_draft(
+    draft_id: str,
+    response: Response,
+    draft: dict = Body(...),
+    if_match: Optional[str] = Header(None),
+):
+    return save_draft_changes(draft_id, lambda current: {**current, **draft}, if_match, response)
+
+@app.patch("/api/drafts/{draft_id}")
+def patch_draft(
+    draft_id: str,
+    response: Response,
+    patch: Any = Body(...),
+    content_type: Optional[str] = Header(None),
+    if_match: Optional[str] = Header(None),
+):
+    """
+    增量修改草稿，只需发送改动的部分：
+    Content-Type 为 application/json-patch+json（或请求体为列表）时按 JSON Patch（RFC 6902）处理，
+    否则按 JSON Merge Patch（RFC 7386）处理。
+    带 If-Match（GET 返回的 ETag）时，草稿在此期间被修改过会返回 412。
+    """
+    json_patch = isinstance(patch, list) or "json-patch" in (content_type or "")
+
+    def apply(current):
+        patched = apply_json_patch(current, patch) if json_patch else apply_merge_patch(current, patch)
+        if not isinstance(patched, dict):
+            raise PatchError("草稿必须是 JSON 对象")
+        return patched
+
+    return save_draft_changes(draft_id, apply, if_match, response)
 
 @app.delete("/api/drafts/{draft_id}")
-async def delete_draft(draft_id: str):
-    drafts = load_drafts()
-    drafts = [d for d in drafts if d['id'] != draft_id]
-    save_drafts(drafts)
+def delete_draft(draft_id: str):
+    get_draft_store().delete_draft(draft_id)
     return {"status": "success"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """响应缓存命中统计，用于估算节省的延迟和 API 费用；render 为草稿 HTML 渲染缓存的统计"""
+    return {**response_cache.stats(), "render": render_cache.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/llm/status")
+async def llm_status():
+    """熔断器状态、准入控制（配额和排队）、相同请求合并（single-flight）的统计，以及各模板类型的 token 用量"""
+    return {
+        **circuit_breaker.status(),
+        "admission": admission_controller.status(),
+        "coalescing": single_flight.stats(),
+        "tokens": token_usage_stats(),
+    }
+
+def edit_source(req: GeminiEditRequest):
+    """
+    返回要编辑的 Markdown 原文：请求中的 content（编辑器的 HTML），或 draftId 对应草稿的内容。
+    发给模型的是 Markdown 而不是 HTML，token 更少，输出也不必再清理标签。
+    """
+    if req.content is not None:
+        return html_to_markdown(req.content)
+    if not req.draftId:
+        raise HTTPException(status_code=422, detail="content or draftId is required")
+    draft = get_draft_store().get_draft(req.draftId)
+    if draft is None:
+        raise HTTPException(status_code=404, detail="Draft not found")
+    content = draft.get("content") or ""
+    return content if draft.get("contentFormat") == "markdown" else html_to_markdown(content)
+
+def write_back_edit(req: GeminiEditRequest, content):
+    """带 draftId 时把编辑结果（Markdown 原文）写回草稿，返回需要附加到响应中的字段"""
+    fields = {"content": content, "contentFormat": "markdown"}
+    if req.draftId and get_draft_store().update_draft(req.draftId, fields):
+        return {"draftId": req.draftId}
+    return {}
+
 @app.post("/api/gemini_edit")
 async def gemini_edit_api(req: GeminiEditRequest):
-    """使用 Gemini 对草稿进行二次编辑"""
-    from core import client
-    prompt = f"""
-你是一个行政文档写作助手。请根据用户的修改要求对以下草稿内容进行修改：
+    """
+    使用 Gemini 对草稿进行二次编辑。
+    section=de/en 时只把这一部分发给模型并拼回原文，请求和输出的 token 都更少。
+    交互式编辑在准入控制中优先于普通和批量生成。
+    """
+    llm_priority.set("interactive")
+    source = await asyncio.to_thread(edit_source, req)
+    try:
+        content = await process_gemini_edit(source, req.instruction, req.section)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"content": render_markdown(content), **await asyncio.to_thread(write_back_edit, req, content)}
+
+@app.post("/api/gemini_edit/stream")
+async def gemini_edit_stream_api(req: GeminiEditRequest):
+    """
+    /api/gemini_edit 的流式版本（SSE）；带 draftId 时把结果写回该草稿。
+    指定 section 时 delta 事件只包含改写后的这一部分，done 事件的 content 为拼接后的全文。
+    """
+    before, target, after = "", await asyncio.to_thread(edit_source, req), ""
+    if req.section:
+        try:
+            before, target, after = locate_section(target, req.section)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    async def chunks():
+        llm_priority.set("interactive")
+        async for chunk in generate_text_stream(build_gemini_edit_prompt(target, req.instruction, req.section)):
+            yield chunk
+
+    def on_done(content):
+        if not req.section:
+            return write_back_edit(req, content)
+        content = before + content.strip() + after
+        return {"content": render_markdown(content), **write_back_edit(req, content)}
+
+    return await sse_response(chunks(), on_done)
+
+# ---- 异步任务：提交后立即返回任务 id，由 worker 池在后台生成并写入草稿 ----
+
+def job_error(e):
+    """把任务执行中的异常转换为保存在任务中的错误信息"""
+    if isinstance(e, LLMError):
+        return e.to_dict()
+    if isinstance(e, TemplateValidationError):
+        return {"code": "invalid_request", "message": str(e), "missing": e.missing}
+    if isinstance(e, HTTPException):
+        return {"code": "invalid_request", "message": str(e.detail)}
+    if isinstance(e, ValueError):
+        return {"code": "invalid_request", "message": str(e)}
+    return {"code": "internal_error", "message": str(e)}
+
+# 后台任务没有客户端在等待，调用 LLM 时按批量优先级排队
+
+async def run_generate_job(payload):
+    llm_priority.set("batch")
+    request = TemplateRequest(**payload)
+    plan = prepare_template_request(request)
+    if plan is None:
+        raise RuntimeError("Template not found")
+    result = await run_generation(plan, request.bypassCache, request.splitLanguages, request.regenerateLanguage)
+    if not result or not result.get("content"):
+        raise RuntimeError("generation failed")
+    saved = await asyncio.to_thread(
+        save_generated_draft, request.templateType, request.templateType, result["content"],
+        request.model_dump(exclude_none=True)
+    )
+    return {**render_result(result, request.templateType), **saved}
+
+async def run_free_prompt_job(payload):
+    llm_priority.set("batch")
+    req = FreePromptRequest(**payload)
+    content = await process_free_prompt(prompt=req.prompt, tone=req.tone)
+    if not content:
+        raise RuntimeError("generation failed")
+    saved = await asyncio.to_thread(
+        save_generated_draft, "freeTextGeneration", req.prompt[:50], content, req.model_dump(exclude_none=True)
+    )
+    return {"content": render_markdown(content), **saved}
 
-【用户要求】：{req.instruction}
+async def run_gemini_edit_job(payload):
+    llm_priority.set("batch")
+    req = GeminiEditRequest(**payload)
+    source = await asyncio.to_thread(edit_source, req)
+    content = await process_gemini_edit(source, req.instruction, req.section)
+    return {"content": render_markdown(content), **await asyncio.to_thread(write_back_edit, req, content)}
 
-【原始草稿】：
-{req.content}
+JOB_HANDLERS = {
+    "generate": run_generate_job,
+    "free_prompt": run_free_prompt_job,
+    "gemini_edit": run_gemini_edit_job,
+}
 
-请严格保留原有文档的结构、格式（如加粗、换行、列表等），只做必要的内容调整。输出格式为 HTML，换行请用<br>，加粗请用<strong>，不要添加解释。
-"""
+async def submit_job(kind, payload, response):
+    """提交任务并唤醒本进程的 worker，返回 202 和任务 id"""
+    job = await asyncio.to_thread(get_job_queue().submit, kind, payload)
+    get_job_pool().notify()
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job['jobId']}"
+    return {"jobId": job["jobId"], "status": job["status"]}
+
+@app.post("/api/jobs/generate")
+async def submit_generate_job(request: TemplateRequest, response: Response):
+    """异步版 /api/generate：字段校验在提交时完成，生成结果保存为草稿（结果中的 draftId）"""
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        content = response.text.replace("\n", "<br>")
-        return {"content": content}
-    except Exception as e:
-        return {"content": f"[Gemini API error] {str(e)}"}
+        prepare_template_request(request)
+    except TemplateValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "missing": e.missing})
+    return await submit_job("generate", request.model_dump(exclude_none=True), response)
+
+@app.post("/api/jobs/free_prompt")
+async def submit_free_prompt_job(req: FreePromptRequest, response: Response):
+    """异步版 /api/free_prompt，生成结果保存为草稿"""
+    if not req.prompt:
+        raise HTTPException(status_code=422, detail="prompt is required")
+    return await submit_job("free_prompt", req.model_dump(exclude_none=True), response)
+
+@app.post("/api/jobs/gemini_edit")
+async def submit_gemini_edit_job(req: GeminiEditRequest, response: Response):
+    """异步版 /api/gemini_edit；带 draftId 时编辑结果写回该草稿"""
+    if req.content is None and not req.draftId:
+        raise HTTPException(status_code=422, detail="content or draftId is required")
+    return await submit_job("gemini_edit", req.model_dump(exclude_none=True), response)
+
+@app.get("/api/jobs/stats")
+def job_stats():
+    """队列深度（各状态的任务数）、最早排队任务的等待时间，以及最近任务的平均等待和执行时间"""
+    return get_job_queue().stats()
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """查询任务状态；排队中时附带 position（前面还有多少个任务），完成后附带 result 或 error"""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "queued":
+        job["position"] = queue.position(job_id)
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    订阅任务状态（SSE）：状态变化时发送 status 事件，
+    完成时发送 done 事件（任务结果），失败时发送 error 事件。
+    """
+    queue = get_job_queue()
+    if await asyncio.to_thread(queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last_status = None
+        while True:
+            job = await asyncio.to_thread(queue.get, job_id)
+            if job["status"] == "done":
+                yield sse_event({"jobId": job_id, **job["result"]}, event="done")
+                return
+            if job["status"] == "failed":
+                yield sse_event({"jobId": job_id, **job["error"]}, event="error")
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield sse_event({"jobId": job_id, "status": last_status}, event="status")
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    parser = argparse.ArgumentParser(description="TUM Assistants 后端服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv('APP_WORKERS', '1')),
+        help="worker 进程数，通常设为 CPU 核数；草稿、任务队列和响应缓存通过 SQLite 文件在进程间共享",
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        # worker 进程会重新导入 main 和 core，通过环境变量传递进程数（用于平分 LLM 配额）
+        # 和共享响应缓存的位置（未配置时使用 backend/response_cache.db）
+        os.environ["APP_WORKERS"] = str(args.workers)
+        os.environ.setdefault("RESPONSE_CACHE_DB", os.path.join(BASE_DIR, 'response_cache.db'))
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=BASE_DIR)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,153 @@
+"""
+模型输出（Markdown）与前端显示用 HTML 之间的转换。
+草稿和响应缓存只保存 Markdown 原文，HTML 只在接口返回时生成：
+- render_markdown：一次遍历把 Markdown 转换为经过清理的 HTML（除少数格式标签外全部转义）
+- MarkdownStream：流式版本，按行输出，加粗标记跨越分块边界也能正确处理
+- html_to_markdown：把编辑器提交的 HTML 转回 Markdown，用于二次编辑的提示词
+"""
+import re
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 一行内的 Markdown 标记和需要处理的字符：**加粗**、*斜体*、允许保留的格式标签、需要转义的字符
+INLINE_TOKEN = re.compile(
+    r'\*\*(?=\S)(?P<bold>.+?)(?<=\S)\*\*'
+    r'|(?<![*\w])\*(?=[^\s*])(?P<em>[^*]+?)(?<=[^\s*])\*(?![*\w])'
+    r'|<(?P<close>/?)(?P<tag>strong|b|em|i|u)\s*>'
+    r'|[&<>"\']'
+)
+HEADING = re.compile(r'^#{1,6}[ \t]+(.*?)[ \t#]*$')
+# 行尾两个空格表示换行，本来就按行输出，去掉即可
+HARD_BREAK = re.compile(r'[ \t]+$')
+# 模型偶尔输出 "<br>\n"，按一次换行处理
+LINE_BREAK = re.compile(r'<br\s*/?>(?:\r?\n)?|\r?\n', re.IGNORECASE)
+
+TAGS = {"strong": "strong", "b": "strong", "em": "em", "i": "em", "u": "u"}
+
+
+def _inline(match):
+    if match.group('bold') is not None:
+        return "<strong>" + render_inline(match.group('bold')) + "</strong>"
+    if match.group('em') is not None:
+        return "<em>" + render_inline(match.group('em')) + "</em>"
+    if match.group('tag') is not None:
+        return f"<{match.group('close')}{TAGS[match.group('tag').lower()]}>"
+    return html.escape(match.group())
+
+
+def render_inline(text):
+    """渲染一行文本中的行内标记，其余字符一律转义"""
+    return INLINE_TOKEN.sub(_inline, text)
+
+
+def render_line(line):
+    line = HARD_BREAK.sub("", line)
+    heading = HEADING.match(line)
+    if heading:
+        return "<strong>" + render_inline(heading.group(1)) + "</strong>"
+    return render_inline(line)
+
+
+def render_markdown(text):
+    """
+    把模型输出的 Markdown 转换为 HTML：换行为 <br>，**加粗** 为 <strong>，*斜体* 为 <em>，
+    标题行加粗显示；'---' 分隔行和列表符号保持原样。
+    模型输出中的 <br>/<strong> 等格式标签按原意保留，其余 HTML 全部转义。
+    """
+    if not text:
+        return text or ""
+    return "<br>".join(render_line(line) for line in LINE_BREAK.split(text))
+
+
+class MarkdownStream:
+    """
+    流式渲染：feed 返回已完整的行对应的 HTML，未结束的一行留到下一块，close 输出剩余部分。
+    所有输出拼接起来与 render_markdown(全文) 完全相同。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.parts = []  # 原文
+
+    def feed(self, chunk):
+        self.parts.append(chunk)
+        self.buffer += chunk
+        # 被分块截断的 "<br" 或 "\r" 不会匹配，留在缓冲区等下一块；
+        # 末尾的 <br>（或 <br>\r）可能与下一块开头的换行组成一次换行，同样留到下一块
+        breaks = list(LINE_BREAK.finditer(self.buffer))
+        end = len(self.buffer) - self.buffer.endswith("\r")
+        if breaks and breaks[-1].end() >= end and not breaks[-1].group().endswith("\n"):
+            breaks.pop()
+        if not breaks:
+            return ""
+        complete, self.buffer = self.buffer[:breaks[-1].start()], self.buffer[breaks[-1].end():]
+        return render_markdown(complete) + "<br>"
+
+    def close(self):
+        rest, self.buffer = self.buffer, ""
+        return render_markdown(rest)
+
+    @property
+    def source(self):
+        return "".join(self.parts)
+
+
+# 编辑器（TipTap）输出的块级标签按换行处理
+BLOCK_BREAK = re.compile(r'<br\s*/?>|</li>|</(?:p|div|h[1-6])>(?!\s*</li>)', re.IGNORECASE)
+LIST_ITEM = re.compile(r'<li(?:\s[^>]*)?>', re.IGNORECASE)
+BOLD_TAG = re.compile(r'</?(?:strong|b)(?:\s[^>]*)?>', re.IGNORECASE)
+EM_TAG = re.compile(r'</?(?:em|i)(?:\s[^>]*)?>', re.IGNORECASE)
+ANY_TAG = re.compile(r'<[^>]+>')
+
+
+def html_to_markdown(content):
+    """把 HTML（或 Markdown 与 <br> 混合的旧草稿）转换为 Markdown 原文"""
+    if not content or "<" not in content and "&" not in content:
+        return content or ""
+    text = BLOCK_BREAK.sub("\n", content)
+    text = LIST_ITEM.sub("- ", text)
+    text = BOLD_TAG.sub("**", text)
+    text = EM_TAG.sub("*", text)
+    return html.unescape(ANY_TAG.sub("", text)).rstrip("\n")
+
+
+class RenderCache:
+    """
+    按草稿缓存渲染结果（LRU）：原文不变（同一版本）时直接返回上次的 HTML。
+    每个草稿只保留最新版本，修改后自然失效，不需要额外的失效逻辑。
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # 草稿 id -> (原文摘要, HTML)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, key, source):
+        digest = hashlib.sha1(source.encode('utf-8')).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == digest:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        rendered = render_markdown(source)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (digest, rendered)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rendered
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / total if total else 0.0,
+        }
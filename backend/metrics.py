@@ -0,0 +1,189 @@
+"""
+进程内指标，按 Prometheus 文本格式（0.0.4）输出，由 main.py 的 /metrics 暴露。
+只实现用到的 Counter、Gauge 和 Histogram，不依赖 prometheus_client。
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# 默认的延迟分桶（秒），覆盖从模板渲染到 LLM 调用的量级
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metrics = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签分别计数"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge:
+    """
+    采集时才计算的瞬时值：collect() 返回 {标签值元组: 数值}，
+    用于队列深度这类保存在别处（如数据库）的状态。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        _metrics.append(self)
+
+    def samples(self):
+        if self.collect is None:
+            return
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"指标 {self.name} 采集失败：{e}")
+            return
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """累积分桶直方图，附带 _sum 和 _count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}  # labels -> [各桶计数, sum, count]
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时 with 块（异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield self.name + "_bucket", labels, bucket_count
+            labels = _format_labels(self.labelnames, key)
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+
+def render():
+    """以 Prometheus 文本格式输出全部指标"""
+    # 锁内只复制计数器和直方图的当前值；Gauge 的 collect 可能查询数据库，在锁外执行，
+    # 避免阻塞其他线程记录指标
+    with _lock:
+        snapshot = [
+            (metric, None if isinstance(metric, Gauge) else list(metric.samples()))
+            for metric in _metrics
+        ]
+    lines = []
+    for metric, samples in snapshot:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in (metric.samples() if samples is None else samples):
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# HTTP 请求（由 main.py 的中间件记录，route 为路由模板而非实际路径）
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 请求处理耗时", ("method", "route", "status"))
+
+# 生成流程各阶段：prepare（读模板、替换、构造提示词）/ cache / llm / postprocess（Markdown 渲染为 HTML）
+GENERATION_STAGE_SECONDS = Histogram(
+    "generation_stage_duration_seconds", "生成流程各阶段耗时", ("template_type", "stage"))
+GENERATION_SECONDS = Histogram(
+    "generation_duration_seconds", "单次生成的总耗时", ("template_type", "path"))
+
+# LLM 调用（包含重试），outcome 为 ok 或 LLMError 的 code
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds", "LLM 调用耗时（含重试）", ("provider", "mode", "outcome"))
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "LLM 用量元数据中的 token 数（kind 为 input / cached / output）",
+    ("provider", "template_type", "kind"))
+LLM_ERRORS = Counter(
+    "llm_errors_total", "LLM 调用失败次数", ("provider", "code"))
+LLM_ADMISSIONS = Counter(
+    "llm_admissions_total", "准入控制结果（admitted 直接放行 / queued 排队后放行 / rejected 拒绝）",
+    ("priority", "result"))
+LLM_ADMISSION_WAIT_SECONDS = Histogram(
+    "llm_admission_wait_seconds", "排队等待准入的时间", ("priority",))
+
+# 响应缓存与请求合并
+CACHE_REQUESTS = Counter(
+    "response_cache_requests_total", "响应缓存查询结果", ("template_type", "result"))
+COALESCED_REQUESTS = Counter(
+    "llm_coalesced_requests_total", "与进行中的相同请求合并的次数")
+
+# 草稿存储
+DRAFT_STORE_SECONDS = Histogram(
+    "draft_store_operation_duration_seconds", "草稿存储操作耗时", ("backend", "operation"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+# 异步任务队列（JOB_QUEUE_DEPTH 的 collect 在 main.py 启动任务队列时设置）
+JOBS = Counter(
+    "jobs_total", "任务状态变更次数（status 为 queued / done / failed）", ("kind", "status"))
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "各状态的任务数", ("status",))
+JOB_WAIT_SECONDS = Histogram(
+    "job_wait_duration_seconds", "任务从提交到开始执行的等待时间", ("kind",))
+JOB_RUN_SECONDS = Histogram(
+    "job_run_duration_seconds", "任务执行耗时", ("kind", "status"))
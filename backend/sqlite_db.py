@@ -0,0 +1,45 @@
+"""
+草稿存储、任务队列和响应缓存共用的 SQLite 连接管理。
+所有数据库都使用 WAL 模式：读写互不阻塞，多个 worker 进程可以同时打开同一个文件。
+"""
+import sqlite3
+import threading
+
+
+class SQLiteDatabase:
+    """
+    按线程打开连接（sqlite3 连接不能跨线程共享），首次在某个线程中使用时才连接。
+    timeout 是等待其他连接（包括其他进程）释放写锁的最长时间。
+    """
+
+    def __init__(self, db_path, timeout=30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return Transaction(self.connect())
+
+
+class Transaction:
+    """BEGIN IMMEDIATE 事务：出错时回滚，否则提交"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,5 @@
+import os
+
+# 测试不调用真实的 Gemini，也不读写 backend 目录下的数据库
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("RESPONSE_CACHE_DB", "")
@@ -0,0 +1,45 @@
+from draft_store import SQLiteDraftStore
+
+
+def test_query_fields_omits_missing_keys(tmp_path):
+    store = SQLiteDraftStore(str(tmp_path / "drafts.db"))
+    full = store.create_draft({"type": "notice", "title": "A", "meta": {"tags": ["x"]}, "pinned": True, "note": None})
+    bare = store.create_draft({"type": "notice"})
+
+    drafts, _ = store.query_drafts(fields=["title", "meta", "pinned", "note", "missing"])
+    by_id = {draft["id"]: draft for draft in drafts}
+    assert by_id[full["id"]] == {
+        "id": full["id"], "title": "A", "meta": {"tags": ["x"]}, "pinned": True, "note": None,
+    }
+    assert by_id[bare["id"]] == {"id": bare["id"]}
+
+
+def test_query_fields_matches_full_documents(tmp_path):
+    store = SQLiteDraftStore(str(tmp_path / "drafts.db"))
+    store.create_draft({"type": "notice", "title": "A", "archived": False, "count": 2})
+    store.create_draft({"type": "report", "count": 0})
+
+    fields = ["type", "title", "archived", "count"]
+    projected, _ = store.query_drafts(fields=fields)
+    full, _ = store.query_drafts()
+    assert projected == [
+        {key: value for key, value in draft.items() if key in fields or key == "id"} for draft in full
+    ]
+
+
+def test_search_reports_truncated_candidates(tmp_path, monkeypatch):
+    store = SQLiteDraftStore(str(tmp_path / "drafts.db"))
+    monkeypatch.setattr(SQLiteDraftStore, "SEARCH_CANDIDATES", 3)
+    # 最早的一条标题命中，相关度最高，但不在最新的 3 条候选中
+    store.create_draft({"type": "notice", "title": "Semester", "content": "semester"})
+    for n in range(3):
+        store.create_draft({"type": "notice", "title": f"Draft {n}", "content": "semester start"})
+
+    results, truncated = store.search_drafts("semester")
+    assert truncated
+    assert len(results) == 3
+    assert "Semester" not in [result["title"] for result in results]
+
+    results, truncated = store.search_drafts("start")
+    assert not truncated
+    assert len(results) == 3
@@ -0,0 +1,45 @@
+import time
+
+import metrics
+from job_queue import JobQueue
+
+
+def test_prune_deletes_only_old_finished_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), retention=3600)
+    ids = [queue.submit("generate", {"n": n})["jobId"] for n in range(4)]
+    for _ in ids[:3]:
+        job_id, _, _ = queue.claim("w")
+        if job_id == ids[1]:
+            queue.fail(job_id, "w", {"code": "x", "message": "x"})
+        elif job_id == ids[0]:
+            queue.complete(job_id, "w", {"ok": True})
+    # ids[0] 和 ids[1] 已结束，ids[2] 仍在执行，ids[3] 仍在排队
+    assert queue.prune(time.time() + 60) == 0
+    assert queue.prune(time.time() + 3601) == 2
+    assert queue.get(ids[0]) is None and queue.get(ids[1]) is None
+    assert queue.get(ids[2])["status"] == "running"
+    assert queue.get(ids[3])["status"] == "queued"
+
+
+def test_requeue_expired_prunes_at_most_once_per_interval(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"), retention=3600)
+    pruned = []
+    monkeypatch.setattr(queue, "prune", lambda now=None: pruned.append(now))
+    queue.requeue_expired()
+    queue.requeue_expired()
+    assert len(pruned) == 1
+
+
+def test_render_collects_gauges_outside_lock():
+    def collect():
+        # 持有锁时采集会死锁（threading.Lock 不可重入）
+        assert metrics._lock.acquire(timeout=1)
+        metrics._lock.release()
+        return {("queued",): 3}
+
+    previous = metrics.JOB_QUEUE_DEPTH.collect
+    metrics.JOB_QUEUE_DEPTH.collect = collect
+    try:
+        assert 'job_queue_depth{status="queued"} 3' in metrics.render()
+    finally:
+        metrics.JOB_QUEUE_DEPTH.collect = previous
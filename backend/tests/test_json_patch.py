@@ -0,0 +1,123 @@
+import pytest
+
+from draft_store import PatchError, PatchTestFailed, apply_json_patch, apply_merge_patch
+
+
+@pytest.fixture
+def draft():
+    return {"title": "Notice", "tags": ["a", "b"], "source": {"name": "Team", "a/b": 1, "m~n": 2}}
+
+
+def test_add_sets_key_and_inserts_into_list(draft):
+    result = apply_json_patch(draft, [
+        {"op": "add", "path": "/status", "value": "final"},
+        {"op": "add", "path": "/tags/1", "value": "x"},
+    ])
+    assert result["status"] == "final"
+    assert result["tags"] == ["a", "x", "b"]
+
+
+def test_add_dash_appends_to_list(draft):
+    result = apply_json_patch(draft, [{"op": "add", "path": "/tags/-", "value": "c"}])
+    assert result["tags"] == ["a", "b", "c"]
+
+
+def test_add_past_end_of_list_fails(draft):
+    with pytest.raises(PatchError):
+        apply_json_patch(draft, [{"op": "add", "path": "/tags/3", "value": "c"}])
+
+
+def test_remove(draft):
+    result = apply_json_patch(draft, [
+        {"op": "remove", "path": "/title"},
+        {"op": "remove", "path": "/tags/0"},
+    ])
+    assert "title" not in result
+    assert result["tags"] == ["b"]
+
+
+def test_replace_requires_existing_path(draft):
+    result = apply_json_patch(draft, [{"op": "replace", "path": "/title", "value": "New"}])
+    assert result["title"] == "New"
+    with pytest.raises(PatchError):
+        apply_json_patch(draft, [{"op": "replace", "path": "/missing", "value": 1}])
+
+
+def test_move_and_copy(draft):
+    result = apply_json_patch(draft, [
+        {"op": "copy", "from": "/source/name", "path": "/author"},
+        {"op": "move", "from": "/tags/0", "path": "/tags/-"},
+    ])
+    assert result["author"] == "Team"
+    assert result["source"]["name"] == "Team"
+    assert result["tags"] == ["b", "a"]
+
+
+def test_copy_is_deep(draft):
+    result = apply_json_patch(draft, [
+        {"op": "copy", "from": "/source", "path": "/backup"},
+        {"op": "replace", "path": "/backup/name", "value": "Other"},
+    ])
+    assert result["source"]["name"] == "Team"
+
+
+def test_escaped_pointer_segments(draft):
+    result = apply_json_patch(draft, [
+        {"op": "replace", "path": "/source/a~1b", "value": 10},
+        {"op": "replace", "path": "/source/m~0n", "value": 20},
+    ])
+    assert result["source"]["a/b"] == 10
+    assert result["source"]["m~n"] == 20
+
+
+def test_test_operation(draft):
+    apply_json_patch(draft, [{"op": "test", "path": "/title", "value": "Notice"}])
+    with pytest.raises(PatchTestFailed):
+        apply_json_patch(draft, [{"op": "test", "path": "/title", "value": "Other"}])
+
+
+def test_failed_patch_leaves_document_unchanged(draft):
+    with pytest.raises(PatchTestFailed):
+        apply_json_patch(draft, [
+            {"op": "replace", "path": "/title", "value": "Changed"},
+            {"op": "test", "path": "/title", "value": "Notice"},
+        ])
+    assert draft["title"] == "Notice"
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "add", "path": "title", "value": 1},
+    {"op": "remove", "path": "/missing"},
+    {"op": "remove", "path": "/tags/5"},
+    {"op": "add", "path": "/tags/x", "value": 1},
+    {"op": "add", "path": "/missing/child", "value": 1},
+    {"op": "add", "path": "/title/child", "value": 1},
+    {"op": "remove", "path": ""},
+    {"op": "add", "path": "/title"},
+    {"op": "move", "path": "/title"},
+    {"op": "frobnicate", "path": "/title"},
+    {"path": "/title", "value": 1},
+])
+def test_invalid_operations_raise_patch_error(draft, operation):
+    with pytest.raises(PatchError):
+        apply_json_patch(draft, [operation])
+
+
+def test_patch_must_be_a_list(draft):
+    with pytest.raises(PatchError):
+        apply_json_patch(draft, {"op": "remove", "path": "/title"})
+
+
+def test_merge_patch_null_deletes_and_objects_merge(draft):
+    result = apply_merge_patch(draft, {"title": None, "source": {"name": "New", "a/b": None}, "status": "final"})
+    assert "title" not in result
+    assert result["source"] == {"name": "New", "m~n": 2}
+    assert result["status"] == "final"
+    assert result["tags"] == ["a", "b"]
+
+
+def test_merge_patch_replaces_non_objects(draft):
+    result = apply_merge_patch(draft, {"tags": ["z"], "source": "plain"})
+    assert result["tags"] == ["z"]
+    assert result["source"] == "plain"
+    assert draft["source"]["name"] == "Team"
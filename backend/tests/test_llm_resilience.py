@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from google.genai import errors as genai_errors
+
+import core
+from core import CircuitBreaker, LLMError, invoke_llm
+
+
+class FakeAdmission:
+    """记录 invoke_llm 反馈给准入控制的事件，不做限流"""
+
+    def __init__(self):
+        self.charged = 0
+        self.rate_limited = 0
+        self.successes = 0
+
+    def charge(self, tokens):
+        self.charged += 1
+
+    def record_rate_limited(self):
+        self.rate_limited += 1
+
+    def record_success(self):
+        self.successes += 1
+
+
+def api_error(code):
+    return genai_errors.APIError(code, {"error": {"code": code, "message": f"HTTP {code}"}})
+
+
+def fake_call(*outcomes):
+    """依次返回或抛出 outcomes 中的结果，calls 记录被调用的次数"""
+    calls = []
+
+    def make_call():
+        async def call():
+            outcome = outcomes[len(calls)]
+            calls.append(outcome)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+        return call()
+
+    return make_call, calls
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(core, "backoff_delay", lambda attempt: 0)
+
+
+@pytest.fixture
+def admission():
+    return FakeAdmission()
+
+
+def run(make_call, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    return asyncio.run(invoke_llm(make_call, **kwargs))
+
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_retry_then_succeed(code, admission):
+    make_call, calls = fake_call(api_error(code), "ok")
+    assert run(make_call, retries=2, admission=admission) == "ok"
+    assert len(calls) == 2
+    assert admission.charged == 1
+    assert admission.successes == 1
+    assert admission.rate_limited == (1 if code == 429 else 0)
+
+
+def test_gives_up_after_max_retries(admission):
+    make_call, calls = fake_call(api_error(503), api_error(503), api_error(503), "ok")
+    with pytest.raises(LLMError) as info:
+        run(make_call, retries=2, admission=admission)
+    assert info.value.code == "upstream_error"
+    assert info.value.status == 502
+    assert len(calls) == 3
+
+
+def test_bad_request_is_not_retried(admission):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    make_call, calls = fake_call(api_error(400), "ok")
+    with pytest.raises(LLMError) as info:
+        run(make_call, retries=2, admission=admission, breaker=breaker)
+    assert info.value.code == "bad_request"
+    assert not info.value.retryable
+    assert len(calls) == 1
+    # 400 说明上游可用，不计入熔断
+    assert breaker.state == "closed"
+
+
+def test_timeout(admission):
+    def make_call():
+        return asyncio.sleep(1)
+
+    with pytest.raises(LLMError) as info:
+        run(make_call, timeout=0.01, retries=0, admission=admission)
+    assert info.value.code == "timeout"
+    assert info.value.status == 504
+    assert info.value.retryable
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch, admission):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    make_call, calls = fake_call(api_error(503), api_error(503))
+    with pytest.raises(LLMError):
+        run(make_call, retries=1, admission=admission, breaker=breaker)
+    assert breaker.state == "open"
+
+    # 熔断期间不调用上游，直接失败
+    make_call, calls = fake_call("ok")
+    with pytest.raises(LLMError) as info:
+        run(make_call, retries=2, admission=admission, breaker=breaker)
+    assert info.value.code == "circuit_open"
+    assert info.value.retry_after == 10
+    assert calls == []
+
+    now[0] += 10
+    assert breaker.state == "half_open"
+    make_call, calls = fake_call("ok")
+    assert run(make_call, retries=0, admission=admission, breaker=breaker) == "ok"
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_failed_trial_reopens_breaker(monkeypatch, admission):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+
+    make_call, _ = fake_call(api_error(503))
+    with pytest.raises(LLMError):
+        run(make_call, retries=0, admission=admission, breaker=breaker)
+    now[0] += 10
+    assert breaker.state == "half_open"
+
+    make_call, calls = fake_call(api_error(503), "ok")
+    with pytest.raises(LLMError) as info:
+        run(make_call, retries=2, admission=admission, breaker=breaker)
+    # 试探失败后重新熔断，后续重试不再调用上游
+    assert info.value.code == "circuit_open"
+    assert len(calls) == 1
+    assert breaker.state == "open"
@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+
+import core
+import main
+from core import LLMError
+
+
+def post(path, body):
+    async def request():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json=body)
+    return asyncio.run(request())
+
+
+def test_rejection_before_output_returns_status_and_retry_after(monkeypatch):
+    async def reject(tokens, priority=None):
+        raise LLMError("rate_limited", "请求过多", retryable=True, retry_after=7)
+
+    monkeypatch.setattr(core.admission_controller, "acquire", reject)
+    response = post("/api/free_prompt/stream", {"prompt": "hello"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+    assert response.json()["detail"]["retryAfter"] == 7
+
+
+def test_failure_after_output_is_an_error_event(monkeypatch):
+    async def chunks(prompt, model=None, context=None):
+        yield "第一行\n"
+        raise LLMError("upstream_error", "连接中断", retryable=True, retry_after=3)
+
+    monkeypatch.setattr(main, "generate_text_stream", chunks)
+    response = post("/api/free_prompt/stream", {"prompt": "hello"})
+    assert response.status_code == 200
+    events = response.text.split("\n\n")
+    assert events[0].startswith("data: ")
+    assert "event: error" in response.text
+    assert '"retryAfter": 3' in response.text
+
+
+def test_single_flight_does_not_share_calls_across_priorities():
+    key = lambda priority: core.SingleFlight.make_key(priority, "model", None, "prompt")
+    assert key("batch") != key("interactive")
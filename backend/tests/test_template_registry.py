@@ -0,0 +1,21 @@
+from core import TemplateRegistry
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def test_duplicate_stems_use_first_path_and_warn_once(tmp_path, capsys):
+    write(tmp_path / "Student" / "notice.txt", "student")
+    write(tmp_path / "All" / "notice.txt", "all")
+    write(tmp_path / "All" / "other.txt", "other")
+
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.names() == ["notice", "other"]
+    assert registry.get("notice").text == "all"
+    assert "模板 notice 重名" in capsys.readouterr().out
+
+    # 重名没有变化时轮询不再重复警告
+    assert registry.reload() == []
+    assert capsys.readouterr().out == ""
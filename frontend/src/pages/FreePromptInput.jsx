@@ -1,6 +1,7 @@
 import React, { useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { useTranslation } from '../translations'
+import { errorMessage } from '../utils/apiError'
 import { 
   MessageSquare, 
   RotateCcw, 
@@ -93,7 +94,7 @@ const FreePromptInput = () => {
       
       if (!saveRes.ok) {
         const errorData = await saveRes.json().catch(() => ({}))
-        throw new Error(errorData.detail || t('draftEditor.saveError'))
+        throw new Error(errorMessage(errorData, t('draftEditor.saveError')))
       }
       
       const savedDraft = await saveRes.json()
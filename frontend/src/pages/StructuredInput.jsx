@@ -1,6 +1,7 @@
 import React, { useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { useTranslation } from '../translations'
+import { errorMessage } from '../utils/apiError'
 import { 
   Copy, 
   Save,
@@ -165,7 +166,7 @@ const StructuredInput = () => {
 
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({ detail: 'Generation failed' }))
-        throw new Error(errorData.detail || 'Generation failed')
+        throw new Error(errorMessage(errorData, 'Generation failed'))
       }
 
       const data = await response.json()
@@ -205,7 +206,7 @@ const StructuredInput = () => {
 
       if (!saveRes.ok) {
         const errorData = await saveRes.json().catch(() => ({}));
-        throw new Error(errorData.detail || t('draftEditor.saveError'));
+        throw new Error(errorMessage(errorData, t('draftEditor.saveError')));
       }
 
       const savedDraft = await saveRes.json()
@@ -0,0 +1,18 @@
+// 后端错误的 detail 可能是字符串、结构化对象（{ code, message, missing, ... }）
+// 或 FastAPI 参数校验错误的列表，统一转换为可以直接显示的文本
+export const errorMessage = (errorData, fallback) => {
+  const detail = errorData && errorData.detail
+  if (typeof detail === 'string') {
+    return detail || fallback
+  }
+  if (Array.isArray(detail)) {
+    return detail.map((item) => item.msg || String(item)).join('; ') || fallback
+  }
+  if (detail && typeof detail === 'object') {
+    const missing = Array.isArray(detail.missing) && detail.missing.length
+      ? ` (${detail.missing.join(', ')})`
+      : ''
+    return detail.message ? `${detail.message}${missing}` : fallback
+  }
+  return fallback
+}